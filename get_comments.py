@@ -3,8 +3,17 @@ import os
 from dotenv import load_dotenv
 import psycopg2
 from datetime import datetime, timezone
-import json
-from openai import OpenAI
+import orjson
+import asyncio
+import random
+import string
+import time
+import hashlib
+import logging
+import re
+import sqlite3
+from contextlib import closing
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError
 import tiktoken
 
 
@@ -29,13 +38,93 @@ APIFY_CLIENT = ApifyClient(APIFY_API_KEY)
 
 CONN_STR = os.getenv('DATABASE_URL')
 
+logger = logging.getLogger("get_comments")
+logger.addHandler(logging.NullHandler())
+
+# Translation table that strips ASCII punctuation, used to spot duplicate comments.
+_PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+# Apify run statuses after which a run will not change anymore.
+APIFY_TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT")
+
+# Setup tiktoken encoding for GPT-4 (using the "cl100k_base" encoding) once at import,
+# loading the BPE ranks is expensive and should not be repeated per comment.
+_ENCODING = tiktoken.get_encoding("cl100k_base")
+
+# Model used to filter comments. The task is extractive, so the small model is enough;
+# set FILTER_MODEL=gpt-4o to compare quality against the full model.
+FILTER_MODEL = os.getenv("FILTER_MODEL", "gpt-4o-mini")
+
+# Upper bound on generated tokens per filter request (the model only echoes kept comments).
+FILTER_MAX_OUTPUT_TOKENS = 1500
+
+# Token cap for a multi-post request, input and output alike. The reply can echo every comment of the
+# group back, so a group is kept small enough for that to fit under the model's 16,384 output tokens.
+MULTI_FILTER_MAX_TOKENS = 16000
+
+# Maximum number of OpenAI filter requests in flight at once.
+FILTER_CONCURRENCY = 8
+
+# OpenAI rate limits for the filter model (requests / tokens per minute), and retry policy.
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "450000"))
+OPENAI_MAX_ATTEMPTS = 5
+
+# Cheap prefilter in front of the model: short comments naming an unambiguous action (download,
+# install, sign up, starting a trial) are kept outright, and comments with (almost) no text are dropped;
+# only the rest are sent to OpenAI. A bare app name, "app" or "trial" is left to the model, since words
+# like "haven" or "trial" are just as often used in their everyday sense.
+# Prefilter decisions are cached like the model's, so changing this only affects comments not yet seen.
+KEEP_RE = re.compile(
+    r"\b(download(ed|ing)?|install(ed|ing)?|sign(ed|ing)? up|(start(ed|ing)?|began|got|on) (a |the |my )?(free )?trial)\b",
+    re.I,
+)
+AUTO_KEEP_MAX_CHARS = 280
+AUTO_DROP_MIN_CHARS = 3
+
+# Local sqlite file remembering the filter's decision for every comment it has already judged.
+COMMENT_CACHE_PATH = os.getenv("COMMENT_CACHE_PATH", "comment_cache.db")
+
+# Instructions for the comment filter, shared by the single-post and multi-post prompts.
+# NOTE: This prompt is maybe not great, and maybe TODO: we want a different one for each app. But maybe we move this anyways.
+_FILTER_INSTRUCTIONS = (
+    "You will receive comments from influencer posts promoting our apps: Astra (an astrology app), Haven (a bible app), "
+    "Saga (a generative writing app), and Berry (a women's health app). Your task is to filter and return only those comments that "
+    "demonstrate a user action or intent related to engaging with one of our apps. Even a mention of the app is sufficient. This includes comments suggesting that the user "
+    "downloaded, installed, signed up for a trial, expressed direct interest, or mentioned a specific action prompted by the app or its features. "
+    "Do not include comments that only mention general topics (e.g., astrology, biblical themes, writing, or women's health) unless they also "
+    "reference a direct engagement with the app. Err on the side of inclusion when in doubt. "
+)
+
+# Output format for the single-post prompt and the multi-post prompt.
+_FILTER_OUTPUT_FORMAT = (
+    "The user message is a JSON object of the form {\"comments\": [...]}. "
+    "IMPORTANT: The output should be a JSON object of the form {\"kept\": [...]}, where \"kept\" is an array of strings "
+    "(each string should be one comment). Nothing more, including markdown. \n\n"
+)
+_MULTI_FILTER_OUTPUT_FORMAT = (
+    "The user message groups the comments by post in a JSON object keyed by post id. "
+    "IMPORTANT: The output should be a JSON object with exactly the same keys, each mapping to a JSON array of the kept comments "
+    "for that post (an empty array if none are kept). Nothing more, including markdown. \n\n"
+)
+
+# The static instructions live in the system message, so every request starts with the same
+# prefix (eligible for OpenAI's automatic prompt caching) and the user message is only JSON.
+_FILTER_SYSTEM_PROMPT = _FILTER_INSTRUCTIONS + _FILTER_OUTPUT_FORMAT
+_MULTI_FILTER_SYSTEM_PROMPT = _FILTER_INSTRUCTIONS + _MULTI_FILTER_OUTPUT_FORMAT
+
+# Exact token cost of the static prompt text around the comments, counted once at import,
+# plus a small allowance for the chat message framing and the {"comments": ...} wrapper.
+_PROMPT_OVERHEAD = len(_ENCODING.encode(_FILTER_SYSTEM_PROMPT)) + 32
+_MULTI_PROMPT_OVERHEAD = len(_ENCODING.encode(_MULTI_FILTER_SYSTEM_PROMPT)) + 32
+
 
 # ----------------------------
-# FETCH COMMENTS FROM A SOCIAL MEDIA POST.
+# START THE APIFY COMMENT SCRAPER FOR A SOCIAL MEDIA POST WITHOUT WAITING FOR IT.
 # - SELECTS THE APPROPRIATE APIFY ACTOR BASED ON THE URL (INSTAGRAM OR TIKTOK).
-# - RETURNS A LIST OF COMMENT STRINGS.
+# - RETURNS THE RUN METADATA, OR None IF THE URL IS NOT INSTAGRAM OR TIKTOK.
 # ----------------------------
-def get_comments(url):
+def _start_comment_run(url):
 
     """
     For Instagram:
@@ -45,7 +134,7 @@ def get_comments(url):
     """
 
     # Determine which actor and input to use based on the URL
-    # Return an empty array if Youtube or something else
+    # Return None if Youtube or something else
     if "instagram.com" in url:
         actor_id = "apify/instagram-comment-scraper"
         run_input = {
@@ -63,58 +152,121 @@ def get_comments(url):
             # it seems there is no way to get recent comments, even with other actors
         }
     else:
-        return []
-    
+        return None
 
+    # Start the actor; this returns as soon as the run is queued.
+    return APIFY_CLIENT.actor(actor_id).start(run_input=run_input)
+
+
+# ----------------------------
+# READ THE COMMENTS FROM A FINISHED APIFY RUN.
+# - RETURNS A LIST OF COMMENT STRINGS, OR None IF THE RUN FAILED.
+# ----------------------------
+def _read_comments(url, run):
     try:
-        # Call the actor
-        run = APIFY_CLIENT.actor(actor_id).call(run_input=run_input)
-        
+        if run.get("status") != "SUCCEEDED":
+            raise ValueError(f"Actor run ended with status {run.get('status')}.")
+
         # Retrieve the default dataset ID from the run metadata.
         dataset_id = run.get("defaultDatasetId")
         if not dataset_id:
             raise ValueError("No dataset ID found in the run response.")
-        
-        # Fetch the dataset items using Apify API v2 endpoint.
-        dataset_response = APIFY_CLIENT.dataset(dataset_id).list_items()
-        data = dataset_response.items
 
-        comments = []
-        for item in data:
-            comments.append(item["text"])
-        
+        # Stream the dataset items page by page instead of buffering the whole dataset first.
+        comments = [item["text"] for item in APIFY_CLIENT.dataset(dataset_id).iterate_items() if "text" in item]
+
         return comments
 
     except Exception as e:
-        print(f"Error retrieving comments for url {url}: {str(e)}")
+        logger.error("Error retrieving comments for url %s: %s", url, e)
         return None
 
 
+# ----------------------------
+# FETCH COMMENTS FOR SEVERAL POSTS CONCURRENTLY.
+# - STARTS EVERY ACTOR RUN UP FRONT, THEN POLLS THE RUNS UNTIL EACH ONE FINISHES,
+#   SO ALL THE SCRAPES PROCEED IN PARALLEL ON APIFY WHILE ONE THREAD WAITS.
+# - RETURNS A LIST OF RESULTS IN THE SAME ORDER AS `urls`
+#   ([] FOR A NON INSTAGRAM/TIKTOK URL, None FOR A FAILED URL).
+# ----------------------------
+def get_comments_many(urls, poll_seconds=5):
+    results = [None] * len(urls)
+
+    # Kick off all runs; `pending` maps the url's position to its run id.
+    pending = {}
+    for i, url in enumerate(urls):
+        try:
+            run = _start_comment_run(url)
+        except Exception as e:
+            logger.error("Error retrieving comments for url %s: %s", url, e)
+            continue
+        if run is None:
+            results[i] = []
+        else:
+            pending[i] = run["id"]
+
+    # Poll the outstanding runs until they all reach a terminal status.
+    while pending:
+        for i, run_id in list(pending.items()):
+            try:
+                run = APIFY_CLIENT.run(run_id).get()
+            except Exception as e:
+                logger.error("Error retrieving comments for url %s: %s", urls[i], e)
+                del pending[i]
+                continue
+            if run and run.get("status") in APIFY_TERMINAL_STATUSES:
+                del pending[i]
+                results[i] = _read_comments(urls[i], run)
+        if pending:
+            time.sleep(poll_seconds)
+
+    return results
+
+
+# ----------------------------
+# FETCH COMMENTS FROM A SOCIAL MEDIA POST.
+# - RETURNS A LIST OF COMMENT STRINGS ([] FOR A NON INSTAGRAM/TIKTOK URL, None ON FAILURE).
+# ----------------------------
+def get_comments(url):
+    return get_comments_many([url])[0]
+
+
 # ----------------------------
 # COUNT TOKENS IN A GIVEN TEXT.
 # - USES TIKTOKEN WITH GPT-4 (cl100k_base ENCODING).
 # - RETURNS THE NUMBER OF TOKENS.
 # ----------------------------
 def count_tokens(text):
-    # Setup tiktoken encoding for GPT-4 (using the "cl100k_base" encoding)
-    encoding = tiktoken.get_encoding("cl100k_base")
     """Returns the number of tokens in the provided text."""
-    return len(encoding.encode(text))
+    return len(_ENCODING.encode(text))
+
+
+# ----------------------------
+# ESTIMATE TOKENS IN A GIVEN TEXT.
+# - USES THE ~4 CHARACTERS PER TOKEN RULE OF THUMB, PLUS A SMALL PER-COMMENT MARGIN.
+# - ONLY USED FOR BATCH SIZING, WHERE AN EXACT COUNT IS NOT NEEDED.
+# ----------------------------
+def _estimate_tokens(text):
+    return (len(text) >> 2) + 8
 
 
 # ----------------------------
 # SPLIT COMMENTS INTO BATCHES BASED ON TOKEN LIMIT.
 # - ENSURES EACH BATCH, INCLUDING A FIXED PROMPT OVERHEAD, DOES NOT EXCEED THE MAX TOKEN LIMIT.
+# - SIZES BATCHES FROM CHARACTER COUNTS AND ONLY RUNS THE TOKENIZER WHEN A BATCH LOOKS FULL.
 # - RETURNS A LIST OF COMMENT BATCHES.
 # ----------------------------
-def split_into_batches(comments, max_tokens_per_batch=30000, prompt_overhead=200):
+def split_into_batches(comments, max_tokens_per_batch=28000, prompt_overhead=200):
     """
     Splits a list of comment strings into batches where each batch's token count,
     including a fixed prompt overhead, stays below max_tokens_per_batch.
+    Comment sizes are estimated from string length (see `_estimate_tokens`); when the
+    estimate says a batch is full, the serialized batch is encoded once to check the exact
+    count, and the batch is only closed if it really is over the cap.
     
     Parameters:
         comments (list): A list of comment strings.
-        max_tokens_per_batch (int): Maximum token count per batch (default set to 30,000).
+        max_tokens_per_batch (int): Maximum token count per batch (default set to 28,000).
         prompt_overhead (int): Fixed token count for the static prompt text.
         
     Returns:
@@ -124,12 +276,18 @@ def split_into_batches(comments, max_tokens_per_batch=30000, prompt_overhead=200
     current_batch = []
     current_tokens = prompt_overhead  # Account for the tokens in the prompt
     for comment in comments:
-        tokens_in_comment = count_tokens(comment)
-        # If adding this comment exceeds the max token count, start a new batch.
-        if current_tokens + tokens_in_comment > max_tokens_per_batch:
-            batches.append(current_batch)
-            current_batch = [comment]
-            current_tokens = prompt_overhead + tokens_in_comment
+        tokens_in_comment = _estimate_tokens(comment)
+        # If the estimate says this comment does not fit, check the exact count of the batch with it.
+        if current_batch and current_tokens + tokens_in_comment > max_tokens_per_batch:
+            exact_tokens = prompt_overhead + count_tokens(orjson.dumps(current_batch + [comment]).decode())
+            if exact_tokens > max_tokens_per_batch:
+                batches.append(current_batch)
+                current_batch = [comment]
+                current_tokens = prompt_overhead + tokens_in_comment
+                continue
+            # It fits: continue from the exact count so the next check happens later.
+            current_batch.append(comment)
+            current_tokens = exact_tokens
         else:
             current_batch.append(comment)
             current_tokens += tokens_in_comment
@@ -138,60 +296,480 @@ def split_into_batches(comments, max_tokens_per_batch=30000, prompt_overhead=200
     return batches
 
 
+# ----------------------------
+# BUILD A CHAT COMPLETION REQUEST BODY: STATIC SYSTEM PROMPT + JSON USER MESSAGE.
+# - THE OUTPUT CAN NEVER BE LONGER THAN THE COMMENTS IT ECHOES BACK, SO `max_tokens` IS
+#   SIZED FROM THE SERIALIZED COMMENTS (CAPPED AT `max_output_tokens`) RATHER THAN A FIXED VALUE.
+# ----------------------------
+def _chat_request_body(system_prompt, comments_json, max_output_tokens=FILTER_MAX_OUTPUT_TOKENS):
+    return {
+        "model": FILTER_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": comments_json},
+        ],
+        "temperature": 0.0,
+        "max_tokens": min(max_output_tokens, count_tokens(comments_json) + 64),
+        # JSON mode: the server guarantees a well-formed JSON object (no markdown fences or prose).
+        "response_format": {"type": "json_object"},
+    }
+
+
+# ----------------------------
+# BUILD THE CHAT COMPLETION REQUEST BODY FOR ONE BATCH OF COMMENTS.
+# - SHARED BY THE REGULAR (CONCURRENT) PATH AND THE BATCH API PATH.
+# ----------------------------
+def _filter_request_body(batch):
+    comments_json = orjson.dumps({"comments": batch}).decode()
+    return _chat_request_body(_FILTER_SYSTEM_PROMPT, comments_json)
+
+
+# ----------------------------
+# PARSE THE MODEL'S RESPONSE TEXT INTO A LIST OF FILTERED COMMENTS.
+# - EXPECTS A JSON OBJECT OF THE FORM {"kept": [...]}.
+# - RETURNS None IF THE RESPONSE CANNOT BE PARSED, SO THE BATCH IS NOT CACHED AS "NOTHING KEPT".
+# ----------------------------
+def _parse_filter_response(result_text):
+    try:
+        # Parse the response text as JSON to get the list of filtered comments.
+        filtered_batch = orjson.loads(result_text).get("kept")
+        if isinstance(filtered_batch, list):
+            return filtered_batch
+        logger.warning("Unexpected JSON format, expected a list but got: %s", type(filtered_batch))
+    except Exception as e:
+        logger.error("Error parsing JSON response: %s", e)
+        logger.error("Raw response: %s", result_text)
+    return None
+
+
+# ----------------------------
+# THROTTLE AND RETRY OPENAI CHAT COMPLETION CALLS.
+# - A SEMAPHORE CAPS HOW MANY REQUESTS ARE IN FLIGHT AT ONCE.
+# - A TOKEN BUCKET KEEPS US UNDER THE REQUESTS/TOKENS PER MINUTE LIMITS, SO WE WAIT
+#   BEFORE SENDING INSTEAD OF BURNING CALLS ON 429s.
+# - RATE LIMIT AND NETWORK ERRORS ARE RETRIED WITH RANDOM EXPONENTIAL BACKOFF.
+# - ONE INSTANCE PER EVENT LOOP (asyncio PRIMITIVES ARE BOUND TO THE LOOP THAT USES THEM).
+# ----------------------------
+class _OpenAIThrottle:
+
+    def __init__(self, concurrency=FILTER_CONCURRENCY, requests_per_minute=OPENAI_RPM, tokens_per_minute=OPENAI_TPM):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = asyncio.Lock()
+        self._available_requests = requests_per_minute
+        self._available_tokens = tokens_per_minute
+        self._last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._available_requests = min(self.requests_per_minute, self._available_requests + elapsed * self.requests_per_minute / 60)
+        self._available_tokens = min(self.tokens_per_minute, self._available_tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def _wait_for_capacity(self, tokens):
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._available_requests >= 1 and self._available_tokens >= tokens:
+                    self._available_requests -= 1
+                    self._available_tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._available_requests) * 60 / self.requests_per_minute,
+                    (tokens - self._available_tokens) * 60 / self.tokens_per_minute,
+                    0.05,
+                )
+                await asyncio.sleep(wait)
+
+    async def create(self, client, body):
+        # Budget for the prompt plus the most the model may generate.
+        tokens = sum(_estimate_tokens(message["content"]) for message in body["messages"]) + body.get("max_tokens", 0)
+
+        for attempt in range(OPENAI_MAX_ATTEMPTS):
+            await self._wait_for_capacity(tokens)
+            try:
+                async with self.semaphore:
+                    return await client.chat.completions.create(**body)
+            except (RateLimitError, APIConnectionError, APITimeoutError) as e:
+                if attempt == OPENAI_MAX_ATTEMPTS - 1:
+                    raise
+                delay = random.uniform(1, min(60, 2 ** (attempt + 1)))
+                logger.warning("OpenAI request failed (%s), retrying in %.1fs", type(e).__name__, delay)
+                await asyncio.sleep(delay)
+
+
+# ----------------------------
+# FILTER A SINGLE BATCH OF COMMENTS USING THE OPENAI API.
+# - THE THROTTLE KEEPS CONCURRENT BATCHES UNDER THE RATE LIMITS AND RETRIES TRANSIENT ERRORS.
+# - RETURNS THE FILTERED COMMENTS FOR THIS BATCH AS A LIST (None ON A BAD RESPONSE).
+# ----------------------------
+async def _filter_batch(client, throttle, batch):
+
+    # Call the ChatCompletion endpoint.
+    chat_completion = await throttle.create(client, _filter_request_body(batch))
+
+    # Extract the text from the response.
+    result_text = chat_completion.choices[0].message.content.strip()
+    return _parse_filter_response(result_text)
+
+
+# ----------------------------
+# FILTER BATCHES OF COMMENTS THROUGH THE OPENAI BATCH API.
+# - UPLOADS ONE JSONL REQUEST PER BATCH, THEN POLLS UNTIL THE JOB FINISHES (UP TO 24H).
+# - HALF THE COST OF THE REGULAR ENDPOINT AND USES A SEPARATE RATE LIMIT POOL,
+#   SO IT IS MEANT FOR NON-INTERACTIVE BULK RUNS.
+# - RETURNS ONE LIST OF FILTERED COMMENTS PER BATCH, IN BATCH ORDER (None FOR A FAILED BATCH).
+# ----------------------------
+def _filter_with_batch_api(batches, poll_seconds=30):
+
+    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+    # One request line per batch; custom_id lets us restore the original order.
+    lines = [
+        orjson.dumps({
+            "custom_id": f"b{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _filter_request_body(batch),
+        })
+        for i, batch in enumerate(batches)
+    ]
+    input_file = client.files.create(
+        file=("comment_filter.jsonl", b"\n".join(lines)),
+        purpose="batch",
+    )
+    job = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+    # Poll until the batch job reaches a terminal state.
+    while job.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_seconds)
+        job = client.batches.retrieve(job.id)
+
+    if job.status != "completed" or not job.output_file_id:
+        logger.warning("Batch job %s ended with status %s", job.id, job.status)
+        return [None] * len(batches)
+
+    # Each output line holds the response for one custom_id.
+    filtered_by_id = {}
+    for line in client.files.content(job.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            logger.error("Batch request %s failed: %s", record.get("custom_id"), record.get("error"))
+            continue
+        result_text = response["body"]["choices"][0]["message"]["content"].strip()
+        filtered_by_id[record["custom_id"]] = _parse_filter_response(result_text)
+
+    return [filtered_by_id.get(f"b{i}") for i in range(len(batches))]
+
+
+# ----------------------------
+# NORMALIZE A COMMENT FOR DUPLICATE DETECTION (LOWERCASE, NO PUNCTUATION, SINGLE SPACES).
+# ----------------------------
+def _normalize_comment(comment):
+    return " ".join(comment.lower().translate(_PUNCTUATION_TABLE).split())
+
+
+# ----------------------------
+# DROP REPEATED COMMENTS ("first!", "link?", ...) BEFORE THEY ARE SENT TO THE MODEL.
+# - KEEPS THE FIRST ORIGINAL FOR EACH NORMALIZED FORM, IN ORDER.
+# ----------------------------
+def _dedupe_comments(comments):
+    unique = {}
+    for comment in comments:
+        unique.setdefault(_normalize_comment(comment), comment)
+    return list(unique.values())
+
+
+# ----------------------------
+# MAP THE KEPT (NORMALIZED) COMMENTS BACK ONTO THE ORIGINAL LIST.
+# - EVERY ORIGINAL COMMENT (INCLUDING DUPLICATES) WHOSE NORMALIZED FORM WAS KEPT IS RETURNED, IN ORDER.
+# ----------------------------
+def _restore_kept_comments(comments, kept):
+    return [comment for comment in comments if _normalize_comment(comment) in kept]
+
+
+# ----------------------------
+# CACHE OF FILTER DECISIONS, KEYED BY sha1 OF THE NORMALIZED COMMENT.
+# - A SHORT-LIVED CONNECTION PER CALL, SO THE CACHE IS SAFE TO USE FROM SEVERAL THREADS.
+# ----------------------------
+def _comment_key(normalized):
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def _open_comment_cache():
+    cache = sqlite3.connect(COMMENT_CACHE_PATH, timeout=30)
+    cache.execute("CREATE TABLE IF NOT EXISTS kept (h TEXT PRIMARY KEY, keep INTEGER NOT NULL)")
+    return cache
+
+
+def _load_cached_decisions(keys):
+    decisions = {}
+    with closing(_open_comment_cache()) as cache:
+        # Stay under sqlite's bound parameter limit.
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for key, keep in cache.execute(f"SELECT h, keep FROM kept WHERE h IN ({placeholders})", chunk):
+                decisions[key] = bool(keep)
+    return decisions
+
+
+def _store_cached_decisions(decisions):
+    if not decisions:
+        return
+    with closing(_open_comment_cache()) as cache, cache:
+        cache.executemany(
+            "INSERT OR REPLACE INTO kept (h, keep) VALUES (?, ?)",
+            [(key, int(keep)) for key, keep in decisions.items()],
+        )
+
+
+# ----------------------------
+# KEYWORD PREFILTER: DECIDE THE OBVIOUS COMMENTS WITHOUT CALLING THE MODEL.
+# - RETURNS True (KEEP), False (DROP) OR None (AMBIGUOUS, ASK THE MODEL).
+# ----------------------------
+def _prefilter_comment(comment):
+    normalized = _normalize_comment(comment)
+    if len(normalized) < AUTO_DROP_MIN_CHARS or not any(ch.isalnum() for ch in normalized):
+        return False
+    if len(comment) < AUTO_KEEP_MAX_CHARS and KEEP_RE.search(comment):
+        return True
+    return None
+
+
+# ----------------------------
+# SPLIT THE UNIQUE COMMENTS INTO ONES DECIDED LOCALLY (CACHE OR PREFILTER) AND ONES THE MODEL STILL HAS TO JUDGE.
+# - A CACHED DECISION WINS; NEW PREFILTER DECISIONS ARE CACHED TOO, SO A LATER `KEEP_RE` CHANGE DOES NOT
+#   FLIP THE RESULT FOR A COMMENT ALREADY DECIDED.
+# - RETURNS (KEPT NORMALIZED FORMS DECIDED LOCALLY, UNKNOWN COMMENTS).
+# ----------------------------
+def _split_known(comments):
+    unique = _dedupe_comments(comments)
+    normalized = [_normalize_comment(comment) for comment in unique]
+    keys = [_comment_key(norm) for norm in normalized]
+    cached = _load_cached_decisions(keys)
+
+    kept = set()
+    unknown = []
+    prefiltered = {}
+    for comment, norm, key in zip(unique, normalized, keys):
+        decision = cached.get(key)
+        if decision is None:
+            decision = _prefilter_comment(comment)
+            if decision is None:
+                unknown.append(comment)
+                continue
+            prefiltered[key] = decision
+        if decision:
+            kept.add(norm)
+
+    _store_cached_decisions(prefiltered)
+    return kept, unknown
+
+
+# ----------------------------
+# SAME AS `_split_known`, WITH THE UNKNOWN COMMENTS SPLIT INTO BATCHES FOR THE MODEL.
+# - RETURNS (KEPT NORMALIZED FORMS DECIDED LOCALLY, BATCHES OF UNKNOWN COMMENTS).
+# ----------------------------
+def _split_cached(comments):
+    kept, unknown = _split_known(comments)
+    batches = split_into_batches(unknown, max_tokens_per_batch=28000, prompt_overhead=_PROMPT_OVERHEAD)
+    return kept, batches
+
+
+# ----------------------------
+# RECORD THE MODEL'S ANSWERS IN THE CACHE AND RETURN THE KEPT ORIGINAL COMMENTS.
+# - FAILED BATCHES (None) ARE NOT CACHED, SO THEY ARE ASKED AGAIN ON THE NEXT RUN.
+# ----------------------------
+def _record_filter_results(comments, kept, batches, results):
+    decisions = {}
+    for batch, filtered_batch in zip(batches, results):
+        if filtered_batch is None:
+            continue
+        batch_kept = {_normalize_comment(comment) for comment in filtered_batch if isinstance(comment, str)}
+        kept |= batch_kept
+        for comment in batch:
+            normalized = _normalize_comment(comment)
+            decisions[_comment_key(normalized)] = normalized in batch_kept
+
+    _store_cached_decisions(decisions)
+    return _restore_kept_comments(comments, kept)
+
+
 # ----------------------------
 # FILTER COMMENTS RELATED TO THE APP USING THE OPENAI API.
-# - SPLITS COMMENTS INTO BATCHES TO STAY WITHIN TOKEN LIMITS.
-# - USES CHATGPT (GPT-4) TO FILTER COMMENTS THAT ARE RELEVANT TO ENGAGEMENT WITH THE APP.
+# - DEDUPLICATES THE COMMENTS, DECIDES THE OBVIOUS ONES WITH A KEYWORD PREFILTER (`KEEP_RE`)
+#   AND SKIPS ANY WITH A CACHED DECISION (`COMMENT_CACHE_PATH`).
+# - SPLITS THE REST INTO BATCHES TO STAY WITHIN TOKEN LIMITS.
+# - USES CHATGPT (`FILTER_MODEL`, GPT-4O-MINI BY DEFAULT) TO FILTER COMMENTS THAT ARE RELEVANT TO ENGAGEMENT WITH THE APP.
+# - ALL BATCHES ARE SENT CONCURRENTLY (AT MOST `FILTER_CONCURRENCY` AT A TIME).
 # - RETURNS THE FILTERED COMMENTS AS A LIST.
 # ----------------------------
-def get_comments_about_app(comments):
+async def get_comments_about_app_async(comments):
 
     # Instantiate the client using API key from environment variables.
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-    
-    # Split comments into batches based on token limits.
-    batches = split_into_batches(comments, max_tokens_per_batch=30000, prompt_overhead=300)
-    all_filtered_comments = []
-    
-    for batch in batches:
-
-        # NOTE: This prompt is maybe not great, and maybe TODO: we want a different one for each app. But maybe we move this anyways.
-        prompt = (
-            "Below is a list of comments from influencer posts promoting our apps: Astra (an astrology app), Haven (a bible app), "
-            "Saga (a generative writing app), and Berry (a women's health app). Your task is to filter and return only those comments that "
-            "demonstrate a user action or intent related to engaging with one of our apps. Even a mention of the app is sufficient. This includes comments suggesting that the user "
-            "downloaded, installed, signed up for a trial, expressed direct interest, or mentioned a specific action prompted by the app or its features. "
-            "Do not include comments that only mention general topics (e.g., astrology, biblical themes, writing, or women's health) unless they also "
-            "reference a direct engagement with the app. Err on the side of inclusion when in doubt. "
-            "IMPORTANT: The output should be a JSON array of strings (each string should be one comment). Nothing more, including markdown. \n\n"
-            "Comments:\n" + json.dumps(batch, indent=2)
-        )
-        
-        # Call the ChatCompletion endpoint.
-        chat_completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.2,
-            max_tokens=500,
-        )
-        
-        # Extract the text from the response.
-        result_text = chat_completion.choices[0].message.content.strip()
+    # Retries are handled by the throttle, so the client's own retries are disabled.
+    client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+
+    # Split the unique, not yet cached comments into batches based on token limits.
+    kept, batches = _split_cached(comments)
+
+    throttle = _OpenAIThrottle()
+    results = await asyncio.gather(*[_filter_batch(client, throttle, batch) for batch in batches])
+
+    return _record_filter_results(comments, kept, batches, results)
+
+
+# ----------------------------
+# SYNCHRONOUS WRAPPER AROUND `get_comments_about_app_async` FOR EXISTING CALLERS.
+# - WITH `use_batch_api=True`, THE BATCHES GO THROUGH THE OPENAI BATCH API INSTEAD
+#   (CHEAPER, BUT BLOCKS UNTIL THE BATCH JOB COMPLETES).
+# ----------------------------
+def get_comments_about_app(comments, use_batch_api=False):
+    if use_batch_api:
+        kept, batches = _split_cached(comments)
+        results = _filter_with_batch_api(batches) if batches else []
+        return _record_filter_results(comments, kept, batches, results)
+    return asyncio.run(get_comments_about_app_async(comments))
+
+
+# ----------------------------
+# GROUP SEVERAL POSTS' COMMENTS INTO SHARED REQUESTS.
+# - EACH GROUP IS A DICT OF {"post_<i>": (url, comments)} THAT FITS UNDER THE TOKEN CAP.
+# - POSTS THAT ARE TOO LARGE ON THEIR OWN ARE RETURNED SEPARATELY, TO BE BATCHED PER POST.
+# ----------------------------
+def _group_posts(posts, max_tokens_per_request=MULTI_FILTER_MAX_TOKENS, prompt_overhead=_MULTI_PROMPT_OVERHEAD):
+    groups = []
+    oversized = []
+    current_group = {}
+    current_tokens = prompt_overhead
+    for i, (url, comments) in enumerate(posts.items()):
+        post_tokens = sum(_estimate_tokens(comment) for comment in comments) + 8
+        if prompt_overhead + post_tokens > max_tokens_per_request:
+            oversized.append(url)
+            continue
+        if current_group and current_tokens + post_tokens > max_tokens_per_request:
+            groups.append(current_group)
+            current_group = {}
+            current_tokens = prompt_overhead
+        current_group[f"post_{i}"] = (url, comments)
+        current_tokens += post_tokens
+    if current_group:
+        groups.append(current_group)
+    return groups, oversized
+
+
+# ----------------------------
+# FILTER ONE GROUP OF POSTS IN A SINGLE OPENAI REQUEST.
+# - THE MODEL RECEIVES {"post_1": [...], ...} AND RETURNS THE SAME KEYS WITH THE KEPT COMMENTS.
+# - THE OUTPUT CAP IS SIZED FROM THE GROUP'S COMMENTS (SEE `_chat_request_body`), SO THE FULL ECHO FITS.
+# - RETURNS A DICT OF URL -> FILTERED COMMENTS, OR URL -> None FOR A POST MISSING FROM AN UNPARSEABLE
+#   OR TRUNCATED RESPONSE, OR FOR EVERY POST OF THE GROUP IF THE REQUEST ITSELF FAILED.
+# ----------------------------
+async def _filter_post_group(client, throttle, group):
+    payload = {key: comments for key, (_, comments) in group.items()}
+    comments_json = orjson.dumps(payload).decode()
+
+    try:
+        chat_completion = await throttle.create(client, _chat_request_body(_MULTI_FILTER_SYSTEM_PROMPT, comments_json, max_output_tokens=MULTI_FILTER_MAX_TOKENS))
+    except Exception as e:
+        logger.error("OpenAI request for %s posts failed: %s", len(group), e)
+        return {url: None for url, _ in group.values()}
+
+    result_text = chat_completion.choices[0].message.content.strip()
+    try:
+        filtered = orjson.loads(result_text)
+    except Exception as e:
+        logger.error("Error parsing JSON response: %s", e)
+        logger.error("Raw response: %s", result_text)
+        filtered = {}
+    if not isinstance(filtered, dict):
+        logger.warning("Unexpected JSON format, expected an object but got: %s", type(filtered))
+        filtered = {}
+
+    results = {}
+    for key, (url, _) in group.items():
+        kept = filtered.get(key)
+        if not isinstance(kept, list):
+            logger.warning("No usable filter result for post %s", url)
+            kept = None
+        results[url] = kept
+    return results
+
+
+# ----------------------------
+# FILTER ONE POST TOO LARGE TO SHARE A REQUEST, ONE REQUEST PER BATCH OF ITS COMMENTS.
+# - RETURNS (BATCHES, RESULTS) AS TAKEN BY `_record_filter_results`; A FAILED REQUEST GIVES A None RESULT.
+# ----------------------------
+async def _filter_oversized_post(client, throttle, comments):
+    batches = split_into_batches(comments, max_tokens_per_batch=28000, prompt_overhead=_PROMPT_OVERHEAD)
+
+    async def filter_or_none(batch):
         try:
-            # Parse the response text as JSON to get the list of filtered comments.
-            filtered_batch = json.loads(result_text)
-            if isinstance(filtered_batch, list):
-                all_filtered_comments.extend(filtered_batch)
-            else:
-                print("Unexpected JSON format, expected a list but got:", type(filtered_batch))
+            return await _filter_batch(client, throttle, batch)
         except Exception as e:
-            print("Error parsing JSON response:", e)
-            print("Raw response:", result_text)
-    
-    return all_filtered_comments
+            logger.error("OpenAI request for a batch of %s comments failed: %s", len(batch), e)
+            return None
+
+    results = await asyncio.gather(*[filter_or_none(batch) for batch in batches])
+    return batches, results
+
+
+# ----------------------------
+# FILTER COMMENTS FOR SEVERAL POSTS AT ONCE.
+# - EACH POST GOES THROUGH THE SAME DEDUPLICATION, PREFILTER AND DECISION CACHE AS `get_comments_about_app_async`;
+#   ONLY THE COMMENTS STILL UNKNOWN ARE SENT TO THE MODEL.
+# - PACKS MULTIPLE POSTS INTO EACH REQUEST, SO SMALL POSTS SHARE ONE PROMPT (AND ONE RPM SLOT). POSTS TOO LARGE
+#   TO SHARE ARE BATCHED ON THEIR OWN. ALL REQUESTS SHARE ONE CLIENT AND THROTTLE AND RUN CONCURRENTLY.
+# - `posts` IS A DICT OF URL -> LIST OF COMMENT STRINGS.
+# - RETURNS A DICT OF URL -> LIST OF FILTERED ORIGINAL COMMENTS (None IF ANY OF THE POST'S REQUESTS FAILED).
+# ----------------------------
+async def get_comments_about_app_multi_async(posts):
+
+    client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+    throttle = _OpenAIThrottle()
+
+    known = {url: _split_known(comments) for url, comments in posts.items()}
+    unknown_by_url = {url: unknown for url, (_, unknown) in known.items() if unknown}
+
+    groups, oversized = _group_posts(unknown_by_url)
+    group_results, oversized_results = await asyncio.gather(
+        asyncio.gather(*[_filter_post_group(client, throttle, group) for group in groups]),
+        asyncio.gather(*[_filter_oversized_post(client, throttle, unknown_by_url[url]) for url in oversized]),
+    )
+
+    # (batches, results) per post that went to the model
+    answered = {}
+    for group_result in group_results:
+        for url, filtered in group_result.items():
+            answered[url] = ([unknown_by_url[url]], [filtered])
+    answered.update(zip(oversized, oversized_results))
+
+    results = {}
+    for url, comments in posts.items():
+        kept, _ = known[url]
+        batches, batch_results = answered.get(url, ([], []))
+        results[url] = _record_filter_results(comments, kept, batches, batch_results)
+        if any(batch_result is None for batch_result in batch_results):
+            results[url] = None
+    return results
+
+
+# ----------------------------
+# SYNCHRONOUS WRAPPER AROUND `get_comments_about_app_multi_async`.
+# ----------------------------
+def get_comments_about_app_multi(posts):
+    return asyncio.run(get_comments_about_app_multi_async(posts))
 
 
 
@@ -0,0 +1,44 @@
+-- ----------------------------
+-- INDEXES BACKING THE TRIGGER QUERIES IN `trial_trigger.py`.
+-- CONCURRENTLY SO THEY CAN BE BUILT ON THE LIVE DATABASE WITHOUT LOCKING WRITES
+-- (RUN OUTSIDE A TRANSACTION, e.g. `psql "$DATABASE_URL" -f sql/indexes.sql`).
+-- ----------------------------
+
+-- Hourly/daily trial counts: WHERE app_name = ? AND original_purchase_date_dt in [start, end).
+-- The predicate keeps the column uncast, so this btree serves the range scan directly.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_newtrials_app_time
+    ON NewTrials (app_name, original_purchase_date_dt);
+
+-- "Already triggered recently" checks: WHERE app = ? AND event_type = ? AND event_time >= ?.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ttevents_app_type_time
+    ON TrialTriggerEvents (app, event_type, event_time);
+
+-- One event per trigger occurrence, so two runs racing past the NOT EXISTS guards in `log_hourly_event` /
+-- `daily_trigger` cannot both insert (the loser's INSERT ... ON CONFLICT DO NOTHING returns no row):
+-- - hourly: at most one per app per UTC hour (the 3 hour guard never allows more);
+-- - daily: at most one per app, UTC day and trial count (a later daily event needs a higher count).
+-- Assumes event_time is a timestamptz. Building them fails if duplicates already exist; delete those first.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_ttevents_hourly
+    ON TrialTriggerEvents (app, date_trunc('hour', event_time AT TIME ZONE 'UTC'))
+    WHERE event_type = 'hourly';
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_ttevents_daily
+    ON TrialTriggerEvents (app, ((event_time AT TIME ZONE 'UTC')::date), trial_count)
+    WHERE event_type = 'daily';
+
+-- View scraper: latest DailyVideoData row per post_url (LATERAL ... ORDER BY log_time DESC LIMIT 1).
+-- Covering and partial (the query only reads rows with a create_time), so the per-URL lookup is an
+-- index-only scan. It replaces the plain (post_url, log_time DESC) index.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_dvd_posturl_logtime_cov
+    ON DailyVideoData (post_url, log_time DESC)
+    INCLUDE (id, app, create_time, creator_username, marketing_associate, view_count, comment_count,
+             caption, num_likes, share_count)
+    WHERE create_time IS NOT NULL;
+DROP INDEX CONCURRENTLY IF EXISTS ix_dvd_posturl_logtime;
+
+-- View scraper: WHERE LOWER(app) = ANY(?) AND create_time >= ? (the DailyVideoData app spelling is not enforced).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_dvd_lower_app_createtime
+    ON DailyVideoData (LOWER(app), create_time DESC);
+
+-- Notification email: the top three VideoMetricDeltas rows WHERE trial_trigger_event_id = ?.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_vmd_event
+    ON VideoMetricDeltas (trial_trigger_event_id);
@@ -0,0 +1,60 @@
+import os
+import re
+import tempfile
+import unittest
+
+import get_comments as gc
+
+
+# ----------------------------
+# KEYWORD PREFILTER (`KEEP_RE` / `_prefilter_comment`) AND ITS DECISION CACHE.
+# RUN WITH `python -m unittest discover -s tests` FROM THE REPO ROOT.
+# ----------------------------
+class PrefilterTest(unittest.TestCase):
+
+    # Comments that must reach the model (or be dropped), never be kept outright.
+    NEGATIVE = [
+        "This should not be picked up",
+        "Astrology is cool",
+        "Your account is a haven of safety for me",
+        "This is a free trial of life",
+    ]
+    POSITIVE = [
+        "Just downloaded Haven!",
+        "signed up for the trial",
+        "started my free trial today",
+    ]
+
+    def setUp(self):
+        handle, self.cache_path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.original_cache_path = gc.COMMENT_CACHE_PATH
+        self.original_keep_re = gc.KEEP_RE
+        gc.COMMENT_CACHE_PATH = self.cache_path
+
+    def tearDown(self):
+        gc.COMMENT_CACHE_PATH = self.original_cache_path
+        gc.KEEP_RE = self.original_keep_re
+        os.remove(self.cache_path)
+
+    def test_negative_samples_are_not_auto_kept(self):
+        for comment in self.NEGATIVE:
+            with self.subTest(comment=comment):
+                self.assertIsNot(gc._prefilter_comment(comment), True)
+
+    def test_action_phrases_are_auto_kept(self):
+        for comment in self.POSITIVE:
+            with self.subTest(comment=comment):
+                self.assertIs(gc._prefilter_comment(comment), True)
+
+    def test_prefilter_decision_is_cached(self):
+        kept, unknown = gc._split_known(["Just downloaded Haven!"])
+        self.assertEqual(unknown, [])
+
+        # A later KEEP_RE change must not flip a comment that was already decided.
+        gc.KEEP_RE = re.compile(r"(?!)")
+        self.assertEqual(gc._split_known(["Just downloaded Haven!"]), (kept, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,27 @@
 import psycopg2
+import psycopg2.pool
+from psycopg2.extras import execute_values
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime, timedelta, timezone
+import atexit
 import os
+import zlib
+import io
+import csv
+import logging
+import queue
+import threading
+import sys
+from logging.handlers import QueueHandler, QueueListener
 from dotenv import load_dotenv
-import re
-from apify_client import ApifyClient
+from apify_client import ApifyClientAsync
+# apify-client 1.8.1 does not export its error type publicly; requirements.txt pins that exact version.
+from apify_client._errors import ApifyApiError
 import smtplib
+from email.message import EmailMessage
 from zoneinfo import ZoneInfo
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
 from get_comments import get_comments
 from get_comments import get_comments_about_app
 
@@ -29,7 +44,8 @@ THIS IS LIVE:
 – Hourly Trigger:
   * Looks at the last 3 full days (72 hours) of trial counts (UTC), grouped by hour.
   * Computes the median of the first 71 hours.
-  * Fires if the most recent full hour's count exceeds 1.35× that median plus 4 and is a 2 hour peak.
+  * Fires if the most recent full hour's count exceeds 1.35× that median plus 4, has a z-score above
+    HOURLY_MIN_ZSCORE against the first 71 hours, and is a 2 hour peak.
   * Ensures only one hourly event per 3 UTC hours.
 
 – When either trigger fires:
@@ -50,15 +66,237 @@ load_dotenv()
 CONN_STR = os.getenv('DATABASE_URL')
 
 APIFY_API_KEY = os.environ.get("APIFY_API_KEY")
-APIFY_CLIENT = ApifyClient(APIFY_API_KEY)
+
+# Notification email settings. TO_EMAIL is a comma-separated list; a missing value means no recipients.
+FROM_EMAIL = os.getenv("FROM_EMAIL")
+EMAIL_PASSWORD = os.getenv("APP_EMAIL_PW")
+TO_EMAILS = tuple(email.strip() for email in (os.getenv("TO_EMAIL") or "").split(",") if email.strip())
+
+# Local time zone for the DailyVideoData log_time and the email subject timestamp.
+NY_TZ = ZoneInfo("America/New_York")
+
+# Stylesheet for the notification email, the same for every email.
+EMAIL_CSS = (
+    "<style>"
+      ".card { width: 14rem; margin: 10px; box-shadow: 0 4px 8px rgba(0,0,0,0.2); display: inline-block; background-color: rgba(124,235,157,0.4); border-radius: 10px; }"
+      ".card-body { padding: 10px; }"
+      ".card-subtitle { font-size: 0.95rem; color: #6c757d; }"
+      ".card-text { font-size: 0.9rem; }"
+      ".card-link { text-decoration: none; color: #007bff; }"
+      ".container { text-align: center; }"
+      ".big-link { font-size: 1.5rem; font-weight: bold; }"
+    "</style>"
+)
+
+# One card per top video in the notification email, filled with `str.format`.
+EMAIL_CARD_TMPL = (
+    "<div class='card'>"
+      "<div class='card-body'>"
+        "<h6 class='card-subtitle'>{creator_username}</h6>"
+        "<p class='card-text'>"
+          "<strong>&Delta; Views:</strong> {delta_views:,}<br>"
+          "<strong>&Delta; Comments:</strong> {delta_comments:,}<br>"
+          "<strong>&Delta; Likes:</strong> {delta_likes:,}<br>"
+          "<strong>&Delta; Shares:</strong> {delta_shares:,}"
+        "</p>"
+        "<a href='{post_url}' class='card-link' target='_blank'>View Post</a>"
+      "</div>"
+    "</div>"
+)
+
+# Library-style logger: silent until the caller configures logging. Run as a script, `start_logging` does;
+# a scheduler importing `run_all` / `trial_trigger` should call `start_logging()` (or set up its own handlers).
+logger = logging.getLogger("trial_trigger")
+logger.addHandler(logging.NullHandler())
+
+# App names as used in `NewTrials` / `TrialTriggerEvents` (lowercase, the keys) mapped to how they are
+# written in the campaign sheet and shown in emails (`DailyVideoData` is matched case-insensitively).
+# Every app passed to `trial_trigger` must be listed here.
+APP_DB_NAME = {
+    "saga": "Saga",
+    "berry": "Berry",
+    "haven": "Haven",
+    "astra": "Astra",
+}
+
+# The current hour must also sit this many standard deviations above the mean of the
+# historical hours, so ordinary noise in a busy app does not fire the (expensive) scraper.
+HOURLY_MIN_ZSCORE = 2.5
+
+# Apify metrics scraper per platform, everything that differs between TikTok and Instagram:
+# - "actor_id": the Actor, "run_input": its input template (the batch's URLs are added per run under "url_field"),
+# - "input_url_key": the item key echoing the input URL,
+# - "view_key" / "comment_key" / "likes_key" / "share_key": item keys for the metrics (no share count on Instagram),
+# - "username_path": the (nested) item keys leading to the creator's username.
+ACTOR_CONFIG = {
+    "tiktok": {
+        "actor_id": "clockworks/free-tiktok-scraper",
+        "run_input": {
+            "excludePinnedPosts": True,
+            "resultsPerPage": 1,
+            "shouldDownloadCovers": False,
+            "shouldDownloadSlideshowImages": False,
+            "shouldDownloadSubtitles": False,
+            "shouldDownloadVideos": False,
+            "searchSection": "",
+            "maxProfilesPerQuery": 10
+        },
+        "url_field": "postURLs",
+        "input_url_key": "submittedVideoUrl",
+        "view_key": "playCount",
+        "comment_key": "commentCount",
+        "likes_key": "diggCount",
+        "share_key": "shareCount",
+        "username_path": ("authorMeta", "name"),
+    },
+    "instagram": {
+        "actor_id": "apify/instagram-scraper",
+        "run_input": {
+            "addParentData": False,
+            "enhanceUserSearchWithFacebookPage": False,
+            "isUserReelFeedURL": False,
+            "isUserTaggedFeedURL": False,
+            "resultsLimit": 1,
+            "resultsType": "details",
+            "searchLimit": 1,
+            "searchType": "hashtag"
+        },
+        "url_field": "directUrls",
+        "input_url_key": "inputUrl",
+        "view_key": "videoPlayCount",
+        "comment_key": "commentsCount",
+        "likes_key": "likesCount",
+        "share_key": None,
+        "username_path": ("ownerUsername",),
+    },
+}
+
+# URLs scraped per Apify metrics run, and the maximum number of runs in flight at once (the rest wait for a free slot).
+METRICS_BATCH_SIZE = 50
+# Dataset items fetched per Apify API request when reading a metrics run's results.
+METRICS_ITEMS_PAGE_SIZE = 1000
+APIFY_MAX_CONCURRENT_RUNS = 16
+
+# Retry policy for Apify API calls. The client itself retries rate-limited (429) and 5xx responses with
+# exponential backoff starting at APIFY_RETRY_BASE_MILLIS; anything else fails straight away.
+APIFY_MAX_RETRIES = 3
+APIFY_RETRY_BASE_MILLIS = 1000
+
+# Above this many rows, `insert_rows` loads a table with COPY instead of INSERT.
+COPY_MIN_ROWS = 50
+
+# Shared Postgres connection pool, opened on first use by `_get_pool` (so importing this module does not
+# connect) instead of a new connection per query, and closed when the process exits.
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+# ----------------------------
+# ROUTE ALL LOG RECORDS (THIS MODULE AND `get_comments`) THROUGH A QUEUE.
+# - CALLERS ONLY ENQUEUE THE RECORD; A LISTENER THREAD FORMATS AND WRITES IT, SO THE
+#   SCRAPER'S WORKER THREADS DO NOT SERIALIZE ON STDOUT.
+# - RETURNS THE STARTED LISTENER; CALL .stop() ON IT BEFORE EXITING TO FLUSH PENDING RECORDS.
+# ----------------------------
+def start_logging(level=logging.INFO):
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(log_queue, stream_handler)
+
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener.start()
+    return listener
+
+
+# ----------------------------
+# RETURN THE SHARED CONNECTION POOL, CREATING IT ON THE FIRST CALL.
+# ----------------------------
+def _get_pool():
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                pool = psycopg2.pool.ThreadedConnectionPool(1, 8, CONN_STR)
+                atexit.register(pool.closeall)
+                _POOL = pool
+    return _POOL
+
+
+# ----------------------------
+# BORROW A CONNECTION FROM THE POOL AND YIELD (conn, cursor).
+# - THE CONNECTION IS ALWAYS RETURNED TO THE POOL. A TRANSACTION STILL OPEN ON EXIT (A WRITE THAT FAILED
+#   BEFORE ITS COMMIT) IS ROLLED BACK FIRST; A BROKEN CONNECTION IS CLOSED INSTEAD OF REUSED.
+# - WRITERS MUST CALL conn.commit() THEMSELVES.
+# - PASS `readonly=True` FOR PLAIN SELECTS: THE CONNECTION RUNS IN AUTOCOMMIT, SO NO BEGIN/ROLLBACK
+#   ROUND-TRIPS ARE SPENT ON THEM.
+# ----------------------------
+@contextmanager
+def db_cursor(readonly=False):
+    pool = _get_pool()
+    conn = pool.getconn()
+    try:
+        conn.autocommit = readonly
+        with conn.cursor() as cursor:
+            yield conn, cursor
+    finally:
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                # autocommit cannot be switched inside a transaction, so end it first (a no-op after a commit)
+                conn.rollback()
+                conn.autocommit = False
+            except psycopg2.Error:
+                broken = True
+        pool.putconn(conn, close=broken)
+
+
+# ----------------------------
+# TAKE A PER-APP, PER-DAY POSTGRES ADVISORY LOCK FOR EACH APP, AND YIELD THE APPS THAT WERE LOCKED.
+# - AN APP ALREADY LOCKED BY ANOTHER RUNNING INSTANCE OF THIS SCRIPT IS LEFT OUT, SO IT IS NOT CHECKED
+#   AND SCRAPED TWICE AT THE SAME TIME.
+# - THE LOCKS ARE SESSION LOCKS, HELD UNTIL THE BLOCK EXITS. THAT IS THE WHOLE RUN, SO THEY LIVE ON A DEDICATED
+#   CONNECTION OPENED HERE, NOT ONE BORROWED FROM THE POOL (WHICH WOULD LEAVE THE POOL ONE CONNECTION SHORT).
+# - ON EXIT THE LOCKS ARE RELEASED AND THE CONNECTION CLOSED; A FAILED UNLOCK IS ONLY LOGGED, SINCE CLOSING THE
+#   CONNECTION DROPS THE LOCKS ANYWAY, SO IT NEVER MASKS AN EXCEPTION FROM THE BLOCK.
+# - KEYS ARE (crc32(app) & 0x7fffffff, YYYYMMDD), STABLE ACROSS PROCESSES (UNLIKE hash()).
+# ----------------------------
+@contextmanager
+def app_run_locks(app_names):
+    app_names = list(app_names)
+    keys = [zlib.crc32(app_name.encode()) & 0x7fffffff for app_name in app_names]
+    today = int(datetime.now(timezone.utc).strftime("%Y%m%d"))
+
+    conn = psycopg2.connect(CONN_STR)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT a.app_name
+                  FROM unnest(%s::text[], %s::int[]) AS a(app_name, lock_key)
+                 WHERE pg_try_advisory_lock(a.lock_key, %s)
+            """, (app_names, keys, today))
+            locked = {row[0] for row in cursor.fetchall()}
+        yield [app_name for app_name in app_names if app_name in locked]
+    finally:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock_all()")
+        except psycopg2.Error as e:
+            logger.warning("Could not release the app run locks, they are dropped with the connection: %s", e)
+        conn.close()
+
 
 # ----------------------------
 # DRIVER FUNCTION
 # FIRST TRIES TO TRIGGER FOR DAILY
 # IF DAILY TRIGGER DOES NOT FIRE, THEN TRIES TO TRIGGER FOR HOURLY
+# A FIRED TRIGGER ALSO RUNS THE VIEW SCRAPER AND SENDS THE NOTIFICATION EMAIL
 # RETURNS TRUE IF EITHER TRIGGER IS FIRED
 # ----------------------------
-def trial_trigger(app_name):
+def trial_trigger(app_name, hourly_stats=None):
     # print(f"---Checking daily trigger for {app_name}...---")
     # # First, check the daily trigger
     # if daily_trigger(app_name):
@@ -67,151 +305,194 @@ def trial_trigger(app_name):
     # If daily trigger did not fire, check hourly trigger
     # print(f"---Daily trigger did not fire for {app_name}. Checking hourly trigger...---")
     
-    print("---Checking hourly trigger for", app_name, "...---")
-    print("---We no longer check for a daily trigger---")
-    if hourly_trigger(app_name):
-        print(f"---Hourly trigger fired for {app_name}.---")
+    logger.info("---Checking hourly trigger for %s ...---", app_name)
+    logger.info("---We no longer check for a daily trigger---")
+    if hourly_trigger(app_name, hourly_stats):
+        logger.info("---Hourly trigger fired for %s.---", app_name)
         return True
     
-    print(f"No significant activity detected for {app_name}. No triggers fired.")
+    logger.info("No significant activity detected for %s. No triggers fired.", app_name)
     return False
 
+# ----------------------------
+# RETURN THE SET OF APPS THAT ALREADY HAD AN HOURLY TRIGGER IN THE PAST 3 HOURS.
+# ONE QUERY FOR ALL APPS, SO THE MAIN LOOP CAN SKIP THEM BEFORE FETCHING ANY TRIAL COUNTS
+# (SAME WINDOW AS THE GUARD IN `log_hourly_event`).
+# ----------------------------
+def get_recently_triggered_apps(app_names):
+    current_hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    three_hours_ago = current_hour - timedelta(hours=3)
+    with db_cursor(readonly=True) as (conn, cursor):
+        cursor.execute("""
+            SELECT DISTINCT app
+              FROM TrialTriggerEvents
+             WHERE app = ANY(%s)
+               AND event_type = 'hourly'
+               AND event_time >= %s
+        """, (list(app_names), three_hours_ago))
+        return {row[0] for row in cursor.fetchall()}
+
+
+# ----------------------------
+# FETCH THE HOURLY TRIGGER INPUTS FOR SEVERAL APPS IN ONE QUERY.
+# USES 3 DAYS OF HOURLY TRIAL COUNTS (EMPTY HOURS FILLED WITH 0), ALL AGGREGATED IN SQL, SO ONE ROW COMES BACK PER APP.
+# RETURNS {app_name: stats}, stats BEING A DICT WITH:
+# - "first_hour" / "last_hour": THE WINDOW (last_hour IS THE LATEST FULL HOUR, THE "CURRENT" ONE),
+# - "median" / "mean" / "stdev": OVER THE 71 HOURS BEFORE last_hour (SAMPLE STDEV),
+# - "recent": [current, 1 hour ago, 2 hours ago] COUNTS.
+# ----------------------------
+def fetch_hourly_stats(app_names):
+    current_hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    start_time   = current_hour - timedelta(days=3)  # 72 hours back
+
+    # CRITICAL: The series stops at the last full hour, so the current (partial) hour is never counted
+    # (otherwise the "current" count can be inconsistent)
+    last_full_hour = current_hour - timedelta(hours=1)
+    app_names = list(app_names)
+    with db_cursor(readonly=True) as (conn, cursor):
+        cursor.execute("""
+            WITH hourly AS (
+                SELECT a.app_name, s.slot, COALESCE(c.trial_count, 0) AS trial_count
+                FROM unnest(%(apps)s::text[]) AS a(app_name)
+                CROSS JOIN generate_series(%(start)s::timestamptz, %(last)s::timestamptz, interval '1 hour') AS s(slot)
+                LEFT JOIN (
+                    SELECT
+                      app_name,
+                      date_trunc('hour', original_purchase_date_dt) AS trial_hour,
+                      COUNT(*) AS trial_count
+                    FROM NewTrials
+                    WHERE app_name = ANY(%(apps)s)
+                      AND original_purchase_date_dt >= %(start)s
+                      AND original_purchase_date_dt <  %(end)s
+                    GROUP BY app_name, trial_hour
+                ) c ON c.app_name = a.app_name AND c.trial_hour = s.slot
+            )
+            SELECT
+                app_name,
+                MIN(slot),
+                MAX(slot),
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY trial_count) FILTER (WHERE slot < %(last)s),
+                (AVG(trial_count) FILTER (WHERE slot < %(last)s))::float8,
+                COALESCE(stddev_samp(trial_count) FILTER (WHERE slot < %(last)s), 0)::float8,
+                (array_agg(trial_count ORDER BY slot DESC))[1:3]
+            FROM hourly
+            GROUP BY app_name
+        """, {"apps": app_names, "start": start_time, "last": last_full_hour, "end": current_hour})
+        rows = cursor.fetchall()
+
+    stats_by_app = {}
+    for app_name, first_hour, last_hour, median_val, mean_val, stdev_val, recent in rows:
+        stats_by_app[app_name] = {
+            "first_hour": first_hour,
+            "last_hour": last_hour,
+            "median": median_val,
+            "mean": mean_val,
+            "stdev": stdev_val,
+            "recent": recent,
+        }
+    return stats_by_app
+
+
 # ----------------------------
 # CHECK 3 DAYS OF TRIAL COUNTS FOR A GIVEN APP (GROUPED BY HOUR) FROM THE `NewTrials` TABLE.
 # THIS TABLE LOGGED IN UTC
 # IF THE PAST (full) HOUR TRIAL #s EXCEEDS THE (HISTORICAL MEDIAN + 65%, essentially 1.65x) + 4 HOURLY TRIAL COUNT, TRIGGER FIRES 
 # ALSO ENSURES THAT THE CURRENT HOUR IS A PEAK VS THE LAST 2 HOURS AND HASN'T BEEN AN EVENT WITHIN THE PAST 3 HOURS
-# RETURNS TRUE IF TRIGGER FIRED
+# `hourly_stats` IS THIS APP'S ENTRY FROM `fetch_hourly_stats`; IT IS FETCHED HERE IF NOT GIVEN
+# ONLY LOGS THE `TrialTriggerEvents` ROW: RETURNS THE NEW EVENT ID IF TRIGGER FIRED, OTHERWISE None, AND THE
+# CALLER MUST RUN `fire_downstream` FOR IT (`hourly_trigger` DOES BOTH)
 # ----------------------------
-def hourly_trigger(app_name):
-    # 1) Establish our 3-day window, rounded to the current hour
+def log_hourly_event(app_name, hourly_stats=None):
+    # 1) Current hour, used by the recent-event guard below
     now = datetime.now(timezone.utc)
     current_hour = now.replace(minute=0, second=0, microsecond=0)
-    start_time   = current_hour - timedelta(days=3)  # 72 hours back
 
-    # 2) Fetch counts per hour from NewTrials
-    upper_bound = current_hour + timedelta(hours=1)
-    conn = psycopg2.connect(CONN_STR)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT
-          date_trunc('hour', original_purchase_date_dt) AS trial_hour,
-          COUNT(*) AS trial_count
-        FROM NewTrials
-        WHERE app_name = %s
-          AND original_purchase_date_dt >= %s
-          AND original_purchase_date_dt <  %s
-        GROUP BY trial_hour
-        ORDER BY trial_hour
-    """, (app_name, start_time, upper_bound))
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
-
-    # 3) Build a full 72-hour dict, defaulting to 0
-    hourly_counts = {}
-    for i in range(72):
-        slot = start_time + timedelta(hours=i)
-        hourly_counts[slot] = 0
-    # Fill in actual counts
-    for trial_hour, count in rows:
-        # Ensure timezone‐aware
-        if trial_hour.tzinfo is None:
-            trial_hour = trial_hour.replace(tzinfo=timezone.utc)
-        
-        trial_hour = trial_hour.replace(minute=0, second=0, microsecond=0)
-
-        # Only overwrite if we pre-seeded that slot
-        # CRITICAL: This ensures we only count the full hours that have passed (otherwise indexing -1 can be inconsistent)
-        if trial_hour in hourly_counts:
-            hourly_counts[trial_hour] = count
-
-    # 4) Sort and split into historical vs. current
-    sorted_hours = sorted(hourly_counts.keys())
-    counts       = [hourly_counts[hr] for hr in sorted_hours]
-    if len(counts) < 2:
-        print("Not enough data for hourly median.")
-        return False
+    # 2) Aggregates over the 72 full hours, prefetched for all apps by the caller or fetched here
+    if hourly_stats is None:
+        hourly_stats = fetch_hourly_stats([app_name]).get(app_name)
+    if hourly_stats is None or hourly_stats["median"] is None or len(hourly_stats["recent"]) < 3:
+        logger.info("Not enough data for hourly median.")
+        return None
 
-    historical = counts[:-1]         # first 71 hours
-    current    = counts[-1]         # latest hour (the latest hour that has passed in entirety - not the technical current hour)
-    median_val = (
-      sorted(historical)[len(historical)//2]
-      if len(historical)%2==1
-      else (sorted(historical)[len(historical)//2 - 1] 
-          + sorted(historical)[len(historical)//2]) / 2
-    )
+    # 3) Historical (first 71 hours) vs. current: the latest hour that has passed in entirety,
+    # not the technical current hour
+    current, prev1, prev2 = hourly_stats["recent"]   # this hour, 1 hour ago, 2 hours ago
+    median_val = hourly_stats["median"]
     threshold  = median_val * 1.35 + 4
+    hist_mean  = hourly_stats["mean"]
+    hist_std   = hourly_stats["stdev"]
+    zscore     = (current - hist_mean) / (hist_std + 1e-9)
 
-    print(f"Hourly window: {sorted_hours[0]} → {sorted_hours[-1]}")
-    print("Counts per hour:")
-    for hr, cnt in zip(sorted_hours, counts):
-        print(f"  {hr.isoformat()}: {cnt}")
-    print(f"Historical median (past 71h): {median_val}")
-    print(f"Threshold (1.35× median + 4): {threshold}")
-    print(f"Current hour count: {current}")
+    logger.info("Hourly window: %s → %s", hourly_stats["first_hour"], hourly_stats["last_hour"])
+    logger.info("Historical median (past 71h): %s", median_val)
+    logger.info("Threshold (1.35× median + 4): %s", threshold)
+    logger.info("Current hour count: %s", current)
+    logger.info("Z-score vs past 71h (mean %.2f, std %.2f): %.2f", hist_mean, hist_std, zscore)
 
-    # 5) Only fire if we exceed threshold
+    # 4) Only fire if we exceed threshold
     if current <= threshold:
-        print("No spike this hour; skipping.")
-        return False
+        logger.info("No spike this hour; skipping.")
+        return None
+
+    # Only fire if the spike is also statistically unusual for this app
+    if zscore <= HOURLY_MIN_ZSCORE:
+        logger.info("Z-score %.2f is not above %s; skipping.", zscore, HOURLY_MIN_ZSCORE)
+        return None
     
     # Only fire if we are at a peak vs the last 2 hours
-    prev1 = counts[-2]   # 1 hour ago
-    prev2 = counts[-3]   # 2 hours ago
     if not (current > prev1 and current > prev2):
-        print("Not a peak vs. last 3h; skipping trigger.")
-        return False
+        logger.info("Not a peak vs. last 3h; skipping trigger.")
+        return None
 
-    # 6) Skip if any hourly trigger in the past 3 hours
+    # 5) + 6) Log the new hourly event, unless an hourly trigger fired in the past 3 hours.
+    # Check and insert are one statement (one round-trip) rather than a SELECT and an INSERT on two connections.
+    # Two runs racing past the check are settled by the unique index `ux_ttevents_hourly` (see sql/indexes.sql).
     three_hours_ago = current_hour - timedelta(hours=3)
+    event_time = datetime.now(timezone.utc)
+    with db_cursor() as (conn, cursor):
+        cursor.execute("""
+            INSERT INTO TrialTriggerEvents
+              (event_time, trial_count, average_delta, current_delta,
+               threshold, app, event_type)
+            SELECT %(event_time)s, %(trial_count)s, NULL, NULL, %(threshold)s, %(app)s, 'hourly'
+            WHERE NOT EXISTS (
+                SELECT 1
+                  FROM TrialTriggerEvents
+                 WHERE app = %(app)s
+                   AND event_type = 'hourly'
+                   AND event_time >= %(since)s
+            )
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        """, {
+            "event_time": event_time,
+            "trial_count": current,    # trial count this hour
+            "threshold": threshold,
+            "app": app_name,
+            "since": three_hours_ago,
+        })
+        inserted = cursor.fetchone()
+        conn.commit()
+    if inserted is None:
+        logger.info("An hourly trigger fired in the last 3 hours; skipping.")
+        return None
 
-    conn = psycopg2.connect(CONN_STR)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT 1
-          FROM TrialTriggerEvents
-         WHERE app = %s
-           AND event_type = 'hourly'
-           AND event_time >= %s
-         LIMIT 1
-    """, (app_name, three_hours_ago))
-    already = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    if already:
-        print("An hourly trigger fired in the last 3 hours; skipping.")
-        return False
+    event_id = inserted[0]
+    logger.info("Logged hourly trigger event ID %s.", event_id)
+    return event_id
 
-    # 7) Log the new hourly event
-    conn = psycopg2.connect(CONN_STR)
-    cursor = conn.cursor()
-    event_time = datetime.now(timezone.utc)
-    cursor.execute("""
-        INSERT INTO TrialTriggerEvents
-          (event_time, trial_count, average_delta, current_delta,
-           threshold, app, event_type)
-        VALUES (%s,%s,%s,%s,%s,%s,%s)
-        RETURNING id
-    """, (
-        event_time,
-        current,    # trial count this hour
-        None,       # average_delta (unused)
-        None,       # current_delta (unused)
-        threshold,
-        app_name,
-        'hourly'
-    ))
-    event_id = cursor.fetchone()[0]
-    conn.commit()
-    cursor.close()
-    conn.close()
-    print(f"Logged hourly trigger event ID {event_id}.")
-
-    # 8) Fire downstream actions
-    trigger_view_scraper(app_name, event_id)
-    send_notification_email(app_name.capitalize(), event_id, 'hourly')
 
+# ----------------------------
+# RUN THE HOURLY CHECK FOR ONE APP (SEE `log_hourly_event`) AND, IF IT FIRES, THE VIEW SCRAPER AND EMAIL.
+# RETURNS TRUE IF TRIGGER FIRED
+# ----------------------------
+def hourly_trigger(app_name, hourly_stats=None):
+    event_id = log_hourly_event(app_name, hourly_stats)
+    if event_id is None:
+        return False
+
+    # Call view scraper and send a notification email for the event.
+    fire_downstream({app_name: event_id}, "hourly")
     return True
 
 
@@ -254,7 +535,7 @@ def get_active_campaign_urls(app_name):
         ss = client.open_by_url(campaign_url)
         ws = ss.worksheet("Tiktok Campaigns")
     except Exception as e:
-        print(f"Error opening spreadsheet: {e}")
+        logger.error("Error opening spreadsheet: %s", e)
         return []
 
     all_values = ws.get_all_values()
@@ -267,7 +548,7 @@ def get_active_campaign_urls(app_name):
         status_col = headers.index("Status")    + 1
         app_col    = headers.index("App")       + 1
     except ValueError:
-        print("Required columns 'Video URL', 'Status', or 'App' not found")
+        logger.warning("Required columns 'Video URL', 'Status', or 'App' not found")
         return []
 
     active_urls = []
@@ -289,123 +570,100 @@ def get_active_campaign_urls(app_name):
 
 
 # ----------------------------
-# CHECK 30 DAYS OF TRIAL COUNTS FOR A GIVEN APP (GROUPED BY DATE) FROM THE `NewTrials` TABLE.
-# THIS TABLE LOGGED IN UTC
-# IF TODAY'S TRIAL COUNT EXCEEDS 75% OF THE HISTORICAL MEDIAN DAILY TRIAL COUNT (EXCLUDING TODAY), TRIGGER FIRES
-# RETURNS TRUE IF TRIGGER FIRED
+# FETCH THE DAILY TRIGGER INPUTS FOR SEVERAL APPS IN ONE QUERY.
+# USES 30 DAYS OF TRIAL COUNTS FROM THE `NewTrials` TABLE (GROUPED BY DATE, EMPTY DAYS FILLED WITH 0 IN SQL).
+# RETURNS {app_name: (median_value, current_trial_value)}: THE MEDIAN DAILY COUNT OVER THE 29 DAYS BEFORE TODAY,
+# AND TODAY'S COUNT.
 # ----------------------------
-def daily_trigger(app_name):
+def fetch_daily_stats(app_names):
 
     # Determine our date range (last 30 days, including today)
     now = datetime.now(timezone.utc).date()  # current UTC date
     start_date = now - timedelta(days=29)    # 30 days total
+    upper_bound = now + timedelta(days=1)    # include the entire current day
 
-    # Connect to the database.
-    conn = psycopg2.connect(CONN_STR)
-    cursor = conn.cursor()
-
-    # Query the NewTrials table to get daily trial counts.
-    # We group by the date portion of original_purchase_date_dt.
-    upper_bound = now + timedelta(days=1)  # include the entire current day
+    # generate_series returns one row per (app, day) of the 30-day period, with 0 for days without
+    # trials, so empty days still count towards the median.
+    app_names = list(app_names)
     query = """
-        SELECT DATE(original_purchase_date_dt) AS trial_date, COUNT(*) AS trial_count
-        FROM NewTrials
-        WHERE app_name = %s
-          AND original_purchase_date_dt >= %s
-          AND original_purchase_date_dt < %s
-        GROUP BY trial_date
-        ORDER BY trial_date;
+        WITH daily AS (
+            SELECT a.app_name, d::date AS trial_date, COALESCE(c.trial_count, 0) AS trial_count
+            FROM unnest(%(apps)s::text[]) AS a(app_name)
+            CROSS JOIN generate_series(%(start)s::date, %(today)s::date, interval '1 day') AS d
+            LEFT JOIN (
+                SELECT app_name, DATE(original_purchase_date_dt) AS trial_date, COUNT(*) AS trial_count
+                FROM NewTrials
+                WHERE app_name = ANY(%(apps)s)
+                  AND original_purchase_date_dt >= %(start)s
+                  AND original_purchase_date_dt < %(upper)s
+                GROUP BY app_name, trial_date
+            ) c ON c.app_name = a.app_name AND c.trial_date = d::date
+        )
+        SELECT
+            app_name,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY trial_count) FILTER (WHERE trial_date < %(today)s),
+            MAX(trial_count) FILTER (WHERE trial_date = %(today)s)
+        FROM daily
+        GROUP BY app_name;
     """
-    cursor.execute(query, (app_name, start_date, upper_bound))
-    rows = cursor.fetchall()
+    with db_cursor(readonly=True) as (conn, cursor):
+        cursor.execute(query, {"apps": app_names, "start": start_date, "today": now, "upper": upper_bound})
+        rows = cursor.fetchall()
 
-    # Build a dictionary with one entry per day over the 30-day period, initializing counts to 0.
-    daily_counts = {}
-    for i in range(30):
-        day = start_date + timedelta(days=i)
-        daily_counts[day] = 0
+    stats_by_app = {app_name: (None, None) for app_name in app_names}
+    for app_name, median_value, current_trial_value in rows:
+        stats_by_app[app_name] = (median_value, current_trial_value)
+    return stats_by_app
 
-    # Update our dictionary with the actual counts returned by the query.
-    for row in rows:
-        trial_date, trial_count = row
-        daily_counts[trial_date] = trial_count
 
-    cursor.close()
-    conn.close()
+# ----------------------------
+# CHECK 30 DAYS OF TRIAL COUNTS FOR A GIVEN APP (GROUPED BY DATE) FROM THE `NewTrials` TABLE.
+# THIS TABLE LOGGED IN UTC
+# IF TODAY'S TRIAL COUNT EXCEEDS 75% OF THE HISTORICAL MEDIAN DAILY TRIAL COUNT (EXCLUDING TODAY), TRIGGER FIRES
+# `daily_stats` IS THIS APP'S ENTRY FROM `fetch_daily_stats`; WHEN OMITTED IT IS QUERIED HERE
+# RETURNS TRUE IF TRIGGER FIRED
+# ----------------------------
+def daily_trigger(app_name, daily_stats=None):
 
-    # Create a sorted list of dates and corresponding counts.
-    sorted_dates = sorted(daily_counts.keys())
-    counts = [daily_counts[dt] for dt in sorted_dates]
+    # Median / today's count prefetched by the caller (`fetch_daily_stats`), otherwise queried here
+    if daily_stats is None:
+        daily_stats = fetch_daily_stats([app_name])[app_name]
+    median_value, current_trial_value = daily_stats
 
-    if not counts:
-        print("No data available to compute the median.")
+    if median_value is None or current_trial_value is None:
+        logger.info("No data available to compute the median.")
         return False
 
-    # Compute the historical median trial value using all days except the current day.
-    historical_counts = counts[:-1]  # exclude the latest day (today)
-    sorted_hist_counts = sorted(historical_counts)
-    n = len(sorted_hist_counts)
-    if n % 2 == 1:
-        median_value = sorted_hist_counts[n // 2]
-    else:
-        median_value = (sorted_hist_counts[n // 2 - 1] + sorted_hist_counts[n // 2]) / 2
-
-    # Today's trial count is the last value.
-    current_trial_value = counts[-1]
-
-    # Detailed logging for debugging.
-    print(f"Date range: {sorted_dates[0]} to {sorted_dates[-1]}")
-    print("Daily counts:")
-    for dt, count in zip(sorted_dates, counts):
-        print(f"  {dt.isoformat()}: {count}")
+    now = datetime.now(timezone.utc).date()  # current UTC date
 
     THRESHOLD = median_value * .75 # threshold is 75% of the median
 
-    print(f"Historical median daily trial value (excluding current day): {median_value}")
-    print(f"Threshold: {THRESHOLD}")
-    print(f"Current daily trial value: {current_trial_value}")
+    logger.info("Historical median daily trial value (excluding current day): %s", median_value)
+    logger.info("Threshold: %s", THRESHOLD)
+    logger.info("Current daily trial value: %s", current_trial_value)
 
     # Trigger if exceeds threshold.
     if current_trial_value > THRESHOLD:
 
-        # Check the most recent DAILY trigger event for this app.
-        try:
-            conn = psycopg2.connect(CONN_STR)
-            cursor = conn.cursor()
-            check_query = """
-                SELECT trial_count, event_time
-                FROM TrialTriggerEvents
-                WHERE app = %s AND event_time::date = %s AND event_type = 'daily'
-                ORDER BY event_time DESC
-                LIMIT 1;
-            """
-            cursor.execute(check_query, (app_name, now))
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error checking trial trigger events: {str(e)}")
-            return False
-
-        # If there is a previous DAILY event for the current day, only trigger if the current trial count has increased sufficiently.
-        if result:
-            last_trial_value, last_event_time = result
+        # Minimum required increase over the previous DAILY event's trial count, if one fired today.
+        MIN_INCREASE_THRESHOLD = (median_value * .75) + 200
 
-            # Minimum required increase from previous trial count in event
-            MIN_INCREASE_THRESHOLD = (median_value * .75) + 200
-
-            # UPDATE NEW THRESHOLD
-            THRESHOLD = last_trial_value + MIN_INCREASE_THRESHOLD
-            
-            if current_trial_value < THRESHOLD:
-                return False
-
-        # Proceed to log the event since increase is sufficient in either case (previous daily trigger or not).
+        # Check and log in one statement: if there is a previous DAILY event for the current day,
+        # the row is only inserted when the current trial count has increased sufficiently
+        # (threshold becomes last trial count + MIN_INCREASE_THRESHOLD). No row back means we skip.
+        # Two runs racing past the check are settled by the unique index `ux_ttevents_daily` (see sql/indexes.sql).
         try:
-            conn = psycopg2.connect(CONN_STR)
-            cursor = conn.cursor()
             event_time = datetime.now(timezone.utc)
             insert_event = """
+                WITH last_event AS (
+                    SELECT trial_count
+                    FROM TrialTriggerEvents
+                    WHERE app = %(app)s AND event_time::date = %(today)s AND event_type = 'daily'
+                    ORDER BY event_time DESC
+                    LIMIT 1
+                ), new_threshold AS (
+                    SELECT COALESCE((SELECT trial_count FROM last_event) + %(min_increase)s, %(threshold)s) AS threshold
+                )
                 INSERT INTO TrialTriggerEvents (
                     event_time,
                     trial_count,
@@ -414,32 +672,38 @@ def daily_trigger(app_name):
                     threshold,
                     app,
                     event_type
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+                )
+                SELECT %(event_time)s, %(trial_count)s, NULL, NULL, threshold, %(app)s, 'daily'
+                FROM new_threshold
+                WHERE NOT EXISTS (SELECT 1 FROM last_event)
+                   OR %(trial_count)s >= threshold
+                ON CONFLICT DO NOTHING
                 RETURNING id;
             """
-            cursor.execute(insert_event, (
-                event_time,
-                counts[-1],  # current trial count (latest day)
-                None,
-                None,
-                THRESHOLD,
-                app_name,
-                "daily"  # Indicate this is a daily trigger
-            ))
-            event_id = cursor.fetchone()[0]
-            conn.commit()
-            cursor.close()
-            conn.close()
-            print(f"Trial trigger event logged with ID: {event_id}")
+            with db_cursor() as (conn, cursor):
+                cursor.execute(insert_event, {
+                    "app": app_name,
+                    "today": now,
+                    "min_increase": MIN_INCREASE_THRESHOLD,
+                    "threshold": THRESHOLD,
+                    "event_time": event_time,
+                    "trial_count": current_trial_value,  # current trial count (latest day)
+                })
+                inserted = cursor.fetchone()
+                conn.commit()
         except Exception as e:
-            print(f"Error logging trial trigger event: {str(e)}")
+            logger.error("Error logging trial trigger event: %s", e)
             return False
 
-        # Call view scraper and pass the event ID.
-        trigger_view_scraper(app_name, event_id)
+        if inserted is None:
+            logger.info("A daily trigger already fired today and the increase since then is not sufficient; skipping.")
+            return False
+
+        event_id = inserted[0]
+        logger.info("Trial trigger event logged with ID: %s", event_id)
 
-        # Senda  notification email
-        send_notification_email(app_name.capitalize(), event_id, "daily")
+        # Call view scraper and send a notification email for the event.
+        fire_downstream({app_name: event_id}, "daily")
 
         # And finally, return True as the trigger fired
         return True
@@ -453,95 +717,175 @@ def daily_trigger(app_name):
 # FOR EACH `post_url`, SELECT THE MOST RECENT LOG (BASED ON `log_time`)
 # ALONG WITH ADDITIONAL COLUMNS: `view_count`, `comment_count`, `caption`,
 # `create_time`, `log_time`, AND `num_likes`.
+# `events` MAPS EACH TRIGGERED APP TO ITS EVENT ID; ALL APPS ARE FETCHED IN ONE QUERY AND SCRAPED TOGETHER.
 # ----------------------------
-def trigger_view_scraper(app_name, event_id):
+def trigger_view_scraper_many(events):
 
-    # Capitalize first letter of the app, as this is how it is logged in `DailyVideoData`
-    app_name = app_name.capitalize()
+    # The apps' names as they are shown in the campaign sheet. `DailyVideoData.app` is matched on LOWER(app)
+    # against the lowercase keys, so a row logged as e.g. "HAVEN" is still picked up.
+    for app_name in events:
+        if app_name not in APP_DB_NAME:
+            raise ValueError(f"Unknown app {app_name!r}; add it to APP_DB_NAME")
+    app_names = list(events)
+    db_app_names = [APP_DB_NAME[app_name] for app_name in app_names]
 
     # Calculate threshold: 21 days ago (using UTC)
     threshold_date = datetime.now(timezone.utc) - timedelta(days=21)
 
-    print(f"Threshold date: {threshold_date}")
-
-    # Connect to the database
-    conn = psycopg2.connect(CONN_STR)
-    cursor = conn.cursor()
+    logger.info("Threshold date: %s", threshold_date)
 
     # get the rows where the URL is in the list of active campaigns, but we do not have it here.
-    active_campaigns = get_active_campaign_urls(app_name) # returns a list of URLS
+    active_campaigns = []
+    for db_app_name in db_app_names:
+        active_campaigns.extend(get_active_campaign_urls(db_app_name)) # returns a list of URLS
 
-    print(f"Active campaigns: {active_campaigns}")
+    logger.info("Active campaigns: %s", active_campaigns)
 
-    # Use DISTINCT ON to get, for each post_url posted in last 21 days, the row with the latest log_time.
+    # For each post_url posted in the last 21 days, get the row with the latest log_time.
     # Alternatively, if the url is in the list of active campaigns, we want to get the row with the latest log_time regardless of when it was posted.
-    query = """
-        SELECT DISTINCT ON (post_url)
-            id,
+    # Rows without a create_time are dropped, and the result comes back most recently created first.
+    # The distinct URLs are found first, then a LATERAL top-1 per URL walks `ix_dvd_posturl_logtime_cov`
+    # (post_url, log_time DESC, covering, see sql/indexes.sql), instead of sorting the whole window as DISTINCT ON did.
+    matches = """
+        LOWER(app) = ANY(%(apps)s)
+        AND create_time IS NOT NULL
+        AND (
+              create_time >= %(since)s
+           OR post_url   = ANY(%(campaigns)s)
+        )
+    """
+    query = f"""
+        SELECT latest.*
+        FROM (
+            SELECT DISTINCT post_url
+            FROM DailyVideoData
+            WHERE {matches}
+        ) urls
+        CROSS JOIN LATERAL (
+            SELECT
+                id,
+                post_url,
+                creator_username,
+                marketing_associate,
+                app,
+                view_count,
+                comment_count,
+                caption,
+                create_time,
+                log_time,
+                num_likes,
+                share_count
+            FROM DailyVideoData
+            WHERE post_url = urls.post_url
+              AND {matches}
+            ORDER BY log_time DESC
+            LIMIT 1
+        ) latest
+        ORDER BY latest.create_time DESC;
+    """
+
+    logger.info("Processing videos from the past 21 days:")
+
+    with db_cursor(readonly=True) as (conn, cursor):
+        cursor.execute(query, {"apps": app_names, "since": threshold_date, "campaigns": active_campaigns})
+        rows = cursor.fetchall()
+
+    # Scrape every URL concurrently, then compute the deltas. The DB writes happen below in one go.
+    results = hit_apify_many([row[1] for row in rows])
+
+    deltas_rows = []
+    dvd_rows = []
+    for row, result in zip(rows, results):
+        try:
+            processed = process_video_row(row, events[row[4].lower()], result)
+        except Exception as e:
+            logger.error("Error processing URL %s: %s", row[1], e)
+            continue
+        if processed is None:
+            continue
+        deltas_row, dvd_row = processed
+        deltas_rows.append(deltas_row)
+        dvd_rows.append(dvd_row)
+        logger.debug("Finished processing: %s", row[1])
+
+    if not deltas_rows:
+        return
+
+    # Log all the deltas in VideoMetricDeltas, and the new data to `DailyVideoData` (so if there is another
+    # trigger, we will use these updated entries as the base calculation), in one transaction.
+    try:
+        columns = """
+            trial_trigger_event_id,
             post_url,
             creator_username,
             marketing_associate,
-            app,
-            view_count,
-            comment_count,
-            caption,
-            create_time,
-            log_time,
-            num_likes,
-            share_count
-        FROM DailyVideoData
-        WHERE app = %s
-          AND (
-                create_time >= %s
-             OR post_url   = ANY(%s)
-          )
-        ORDER BY post_url, log_time DESC;
-    """
+            old_view_count,
+            new_view_count,
+            delta_views,
+            old_comment_count,
+            new_comment_count,
+            delta_comments,
+            old_likes,
+            new_likes,
+            delta_likes,
+            app_comments,
+            old_shares,
+            new_shares,
+            delta_shares
+        """
+        with db_cursor() as (conn, cursor):
+            insert_rows(cursor, "VideoMetricDeltas", columns, deltas_rows)
+            log_to_dvd(cursor, dvd_rows)
+            conn.commit()
+        logger.info("Logged metrics deltas and updated DailyVideoData rows for %s URLs", len(deltas_rows))
+    except Exception as e:
+        logger.error("Error logging metrics deltas for events %s: %s", list(events.values()), e)
 
-    cursor.execute(query, (app_name, threshold_date, active_campaigns))
-    rows = cursor.fetchall()
 
-    # Optional: sort the rows by create_time descending (most recent first)
-    rows = [row for row in rows if row[8] is not None]
-    rows.sort(key=lambda x: x[8], reverse=True)
+# ----------------------------
+# RUN THE VIEW SCRAPER FOR A SINGLE TRIGGER EVENT.
+# ----------------------------
+def trigger_view_scraper(app_name, event_id):
+    trigger_view_scraper_many({app_name: event_id})
 
-    cursor.close()
-    conn.close()
 
-    print("Processing videos from the past 21 days:")
+# ----------------------------
+# FIRE THE DOWNSTREAM ACTIONS FOR TRIGGERED APPS: ONE VIEW SCRAPE FOR ALL OF THEM, THEN AN EMAIL PER EVENT
+# (ALL SENT OVER ONE SMTP SESSION).
+# `events` MAPS EACH TRIGGERED APP TO ITS EVENT ID.
+# ----------------------------
+def fire_downstream(events, event_type):
+    if not events:
+        return
+    trigger_view_scraper_many(events)
+
+    # One SMTP login for all the notification emails of this run; the session is closed when the block exits
+    try:
+        with open_smtp_session() as server:
+            for app_name, event_id in events.items():
+                send_notification_email(APP_DB_NAME[app_name], event_id, event_type, server)
+    except smtplib.SMTPAuthenticationError:
+        logger.error("Failed to authenticate. Check your email/password.")
+    except Exception as e:
+        logger.error("An error occurred: %s", e)
 
-    # Process each row concurrently.
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_row = {executor.submit(process_video_row, row, event_id): row for row in rows}
-        for future in as_completed(future_to_row):
-            row = future_to_row[future]
-            try:
-                result = future.result()
-                print(f"Finished processing: {result}")
-            except Exception as e:
-                print(f"Error processing URL {row[1]}: {e}")
 
-    
 # ----------------------------
 # PROCESS A SINGLE VIDEO ROW:
-# - FETCH NEW METRICS VIA APIFY FOR THE GIVEN URL.
+# - TAKES THE NEW METRICS FETCHED VIA APIFY FOR THE ROW'S URL (None IF THE FETCH FAILED).
 # - CALCULATE DELTAS BETWEEN NEW AND OLD METRIC VALUES (views, comments, likes, shares).
-# - RETRIEVE COMMENTS AND FILTER THEM TO EXTRACT APP-RELATED FEEDBACK.
-# - UPDATE THE `VideoMetricDeltas` TABLE WITH THE METRIC DIFFERENCES.
-# - LOG THE UPDATED METRICS TO THE `DailyVideoData` TABLE FOR FUTURE REFERENCE.
+# - RETURNS (VideoMetricDeltas ROW, log_to_dvd ARGUMENTS) FOR THE CALLER TO WRITE IN BULK,
+#   OR None IF THE URL IS SKIPPED.
 # ----------------------------
-def process_video_row(row, event_id):
+def process_video_row(row, event_id, result):
 
     # Unpack columns from the previous event
     _, post_url, creator_username, marketing_associate, app, old_view_count, old_comment_count, caption, create_time, log_time, old_num_likes, old_num_shares = row
-    print(f"Processing URL: {post_url}")
-    print(f"  Previous Metrics -> Views: {old_view_count}, Comments: {old_comment_count}, Likes: {old_num_likes}, Shares: {old_num_shares}")
 
-    # Get new metrics from Apify.
-    result = hit_apify(post_url)
+    # New metrics from Apify.
     if result is None:
-        print(f"  Skipping URL {post_url} due to API failure.")
-        return f"Skipped {post_url}"
+        logger.warning("Skipping URL %s due to API failure.", post_url)
+        return None
 
     username, new_view_count, new_comment_count, new_likes, new_shares = result
 
@@ -552,8 +896,8 @@ def process_video_row(row, event_id):
     delta_shares = new_shares - old_num_shares if new_shares is not None else None
 
     if delta_views is not None and delta_views < 0:
-        print(f"  Skipping URL {post_url} due to negative delta views ({delta_views}).")
-        return f"Skipped {post_url} due to negative delta views"
+        logger.info("Skipping URL %s due to negative delta views (%s).", post_url, delta_views)
+        return None
 
     # NOTE: We used to get the comments for each URL. This is expensive, and better done in one go, as opposed to repeatedly here
     # SO WE NO LONGER DO THIS HERE.
@@ -565,210 +909,235 @@ def process_video_row(row, event_id):
     # print("Got comments, and filtered to those about the app.")
     app_comments = None
 
-    print(f"  Updated Metrics -> Views: {new_view_count}, Comments: {new_comment_count}, Likes: {new_likes}, Shares: {new_shares}")
-    print(f"  Deltas          -> ΔViews: {delta_views}, ΔComments: {delta_comments}, ΔLikes: {delta_likes}, ΔShares: {delta_shares}\n")
+    # One debug line per video: new value and delta for each metric
+    logger.debug(
+        "%s | views %s (Δ%s), comments %s (Δ%s), likes %s (Δ%s), shares %s (Δ%s)",
+        post_url,
+        new_view_count, delta_views,
+        new_comment_count, delta_comments,
+        new_likes, delta_likes,
+        new_shares, delta_shares,
+    )
 
-    # Log these values in VideoMetricDeltas.
-    try:
-        conn = psycopg2.connect(CONN_STR)
-        cursor = conn.cursor()
-        insert_query = """
-            INSERT INTO VideoMetricDeltas (
-                trial_trigger_event_id,
-                post_url,
-                creator_username,
-                marketing_associate,
-                old_view_count,
-                new_view_count,
-                delta_views,
-                old_comment_count,
-                new_comment_count,
-                delta_comments,
-                old_likes,
-                new_likes,
-                delta_likes,
-                app_comments,
-                old_shares,
-                new_shares,
-                delta_shares
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
-        cursor.execute(insert_query, (
-            event_id,
-            post_url,
-            creator_username,
-            marketing_associate,
-            old_view_count,
-            new_view_count,
-            delta_views,
-            old_comment_count,
-            new_comment_count,
-            delta_comments,
-            old_num_likes,
-            new_likes,
-            delta_likes,
-            app_comments,
-            old_num_shares,
-            new_shares,
-            delta_shares
-        ))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"  Logged metrics delta for URL: {post_url}\n")
-
-        # Log new data to `DailyVideoData`, so if there is another trigger, we will use this updated entry as the base calculation
-        insert_time = datetime.now(ZoneInfo("America/New_York")).strftime("%Y-%m-%d %H:%M:%S")
-        log_to_dvd(post_url, creator_username, marketing_associate, app, new_view_count, new_comment_count, caption, create_time, insert_time, new_likes, new_shares)
-        print(f"  Logged updated row to DailyVideoData for URL: {post_url}\n")
-        
-        return f"Processed {post_url}"
-    except Exception as e:
-        print(f"  Error logging metrics for URL {post_url}: {str(e)}\n")
-        return f"Error processing {post_url}"
+    # Row for VideoMetricDeltas (column order matches the INSERT in `trigger_view_scraper_many`).
+    deltas_row = (
+        event_id,
+        post_url,
+        creator_username,
+        marketing_associate,
+        old_view_count,
+        new_view_count,
+        delta_views,
+        old_comment_count,
+        new_comment_count,
+        delta_comments,
+        old_num_likes,
+        new_likes,
+        delta_likes,
+        app_comments,
+        old_num_shares,
+        new_shares,
+        delta_shares
+    )
+
+    # New data for `DailyVideoData`, so if there is another trigger, we will use this updated entry as the base calculation
+    insert_time = datetime.now(NY_TZ).strftime("%Y-%m-%d %H:%M:%S")
+    dvd_row = (post_url, creator_username, marketing_associate, app, new_view_count, new_comment_count, caption, create_time, insert_time, new_likes, new_shares)
+
+    return deltas_row, dvd_row
+
+
+# ----------------------------
+# BULK INSERT `rows` (TUPLES IN `columns` ORDER) INTO `table`.
+# - MORE THAN `COPY_MIN_ROWS` ROWS ARE STREAMED WITH COPY (CSV, NULL AS \N), FEWER ARE SENT AS
+#   MULTI-ROW INSERTS OF 500. VALUES MUST BE SCALARS (STR, NUMBER, DATETIME OR None) FOR THE CSV PATH.
+# - RUNS ON THE CALLER'S CURSOR; THE CALLER COMMITS (AND HANDLES ERRORS).
+# ----------------------------
+def insert_rows(cursor, table, columns, rows):
+
+    if len(rows) > COPY_MIN_ROWS:
+        # None is written as an unquoted \N so it stays distinct from an empty string
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(["\\N" if value is None else value for value in row])
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+        return
+
+    query = f"""
+    INSERT INTO {table} 
+    ({columns})
+    VALUES %s;
+    """
+    execute_values(cursor, query, rows, page_size=500)
 
 
 # ----------------------------
 # LOG THE UPDATED VIDEO METRICS TO THE `DailyVideoData` TABLE.
 # NOTE: IF THE STRUCTRE OF THE TABLE IS CHANGED, THIS ALONG WITH `run_apify_update.py` and `db_manager.py`
 # WOULD NEED TO BE UDPATED. THESE ARE THE ENTRY POINTS FOR NEW LOGS IN `DailyVideoData` TABLE
+# - `rows` ARE (post_url, creator_username, marketing_associate, app, view_count, comment_count,
+#   caption, create_time, log_time, num_likes, share_count) TUPLES.
+# - RUNS ON THE CALLER'S CURSOR; THE CALLER COMMITS (AND HANDLES ERRORS).
+# ----------------------------
+def log_to_dvd(cursor, rows):
+
+    columns = "post_url, creator_username, marketing_associate, app, view_count, comment_count, caption, create_time, log_time, num_likes, share_count"
+    insert_rows(cursor, "DailyVideoData", columns, rows)
+
+
+# ----------------------------
+# PLATFORM OF A POST URL ("tiktok" OR "instagram"), OR None IF IT IS NEITHER.
+# ----------------------------
+def _metrics_url_type(url):
+
+    # Plain substring checks, the platform names are literals.
+    if "tiktok" in url:
+        return "tiktok"
+    if "instagram" in url:
+        return "instagram"
+    logger.warning("URL '%s' does not match TikTok or Instagram. Skipping.", url)
+    return None
+
+
+# ----------------------------
+# EXTRACT THE METRICS FROM A SCRAPED APIFY ITEM.
+# - RETURNS (username, view_count, comment_count, likes_count, share_count).
+# ----------------------------
+def _parse_metrics_item(url_type, item):
+    config = ACTOR_CONFIG[url_type]
+
+    view_count = item.get(config["view_key"], 0)
+    comment_count = item.get(config["comment_key"], None)
+    likes_count = item.get(config["likes_key"], 0)
+
+    # only tiktok allows us to get the share count; for instagram we keep share_count as 0
+    share_count = item.get(config["share_key"], 0) if config["share_key"] else 0
+
+    username = item
+    for key in config["username_path"]:
+        username = username.get(key) if isinstance(username, dict) else None
+
+    return username, view_count, comment_count, likes_count, share_count
+
+
+# ----------------------------
+# HIT APIFY FOR A BATCH OF URLS OF ONE PLATFORM ON THE ASYNC CLIENT: ONE ACTOR RUN FOR ALL OF THEM.
+# - `slots` IS THE SCRAPE'S SEMAPHORE; A RUN IS ONLY STARTED ONCE A SLOT IS FREE.
+# - ITEMS ARE MATCHED BACK TO THEIR URL THROUGH THE INPUT URL THE ACTOR ECHOES ("input_url_key" IN `ACTOR_CONFIG`).
+# - RETURNS {url: metrics tuple} FOR THE URLS THAT CAME BACK; A FAILED RUN RETURNS {}.
 # ----------------------------
-def log_to_dvd(url, username, associate, app, view_count, comment_count, caption, created_at, insert_time, likes_count, share_count):
+async def _hit_apify_batch_async(client, slots, url_type, urls):
+
+    # Actor input for this platform, from the template plus all the URLs of the batch
+    config = ACTOR_CONFIG[url_type]
+    run_input = {**config["run_input"], config["url_field"]: list(urls)}
 
     try:
-        conn = psycopg2.connect(CONN_STR)
-        cursor = conn.cursor()
-        query = """
-        INSERT INTO DailyVideoData 
-        (post_url, creator_username, marketing_associate, app, view_count, comment_count, caption, create_time, log_time, num_likes, share_count)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id;
-        """
-        cursor.execute(query, (
-            url, 
-            username, 
-            associate, 
-            app, 
-            view_count, 
-            comment_count, 
-            caption, 
-            created_at, 
-            insert_time,
-            likes_count,
-            share_count
-        ))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        async with slots:
+            # Start one Actor run for the whole batch, then wait for it without blocking the other batches
+            run = await client.actor(config["actor_id"]).start(run_input=run_input)
+            run = await client.run(run["id"]).wait_for_finish()
+            if not run or run.get("status") != "SUCCEEDED":
+                raise ValueError(f"Actor run ended with status {run.get('status') if run else None}.")
+
+            # Read the whole dataset in large pages (normally a single request for a batch)
+            dataset = client.dataset(run["defaultDatasetId"])
+            items = []
+            while True:
+                page = await dataset.list_items(offset=len(items), limit=METRICS_ITEMS_PAGE_SIZE)
+                items.extend(page.items)
+                if not page.items or len(items) >= page.total:
+                    break
+
+    except ApifyApiError as e:
+        logger.error("Apify API error %s processing %s %s urls (after %s attempts): %s", e.status_code, len(urls), url_type, e.attempt, e)
+        return {}
     except Exception as e:
-        print(f"  Error logging to DailyVideoData for URL {url}: {str(e)}\n")
-        return
-                    
+        logger.error("Error processing %s %s urls: %s", len(urls), url_type, e)
+        return {}
+
+    # Normally one item per URL; keep the first item seen for each
+    results = {}
+    for item in items:
+        url = item.get(config["input_url_key"])
+        if url in urls and url not in results:
+            results[url] = _parse_metrics_item(url_type, item)
+    for url in urls:
+        if url not in results:
+            logger.warning("No metrics returned for url %s.", url)
+    return results
+
+
+# ----------------------------
+# HIT APIFY FOR SEVERAL URLS, AND RETURN THE METRICS
+# - URLS ARE GROUPED BY PLATFORM INTO BATCHES OF `METRICS_BATCH_SIZE`, ONE ACTOR RUN PER BATCH, SO THE
+#   ACTOR START-UP IS PAID ONCE PER BATCH INSTEAD OF ONCE PER URL.
+# - BATCHES RUN CONCURRENTLY ON ONE EVENT LOOP (asyncio.gather), AT MOST `APIFY_MAX_CONCURRENT_RUNS` AT A TIME.
+# - RETURNS A LIST OF RESULTS IN THE SAME ORDER AS `urls` (None FOR A SKIPPED OR FAILED URL).
+# ----------------------------
+async def hit_apify_many_async(urls):
+    client = ApifyClientAsync(
+        APIFY_API_KEY,
+        max_retries=APIFY_MAX_RETRIES,
+        min_delay_between_retries_millis=APIFY_RETRY_BASE_MILLIS,
+    )
+    slots = asyncio.Semaphore(APIFY_MAX_CONCURRENT_RUNS)
+
+    # Distinct URLs per platform, in first-seen order
+    urls_by_type = {}
+    for url in urls:
+        url_type = _metrics_url_type(url)
+        if url_type is not None:
+            urls_by_type.setdefault(url_type, {})[url] = None
+
+    batches = []
+    for url_type, typed_urls in urls_by_type.items():
+        typed_urls = list(typed_urls)
+        for i in range(0, len(typed_urls), METRICS_BATCH_SIZE):
+            batches.append((url_type, typed_urls[i:i + METRICS_BATCH_SIZE]))
+
+    results = {}
+    for batch_results in await asyncio.gather(*(_hit_apify_batch_async(client, slots, url_type, batch) for url_type, batch in batches)):
+        results.update(batch_results)
+    return [results.get(url) for url in urls]
+
+
+def hit_apify_many(urls):
+    return asyncio.run(hit_apify_many_async(urls))
+
 
 # ----------------------------
 # HIT APIFY FOR A URL, AND RETURN THE METRICS
 # ----------------------------
 def hit_apify(url):
+    return hit_apify_many([url])[0]
 
-    tiktok_regex = r"tiktok"
-    instagram_regex = r"instagram"
-
-    if re.search(tiktok_regex, url):
-        url_type = "tiktok"
-    elif re.search(instagram_regex, url):
-        url_type = "instagram"
-    else:
-        print(f"URL '{url}' does not match TikTok or Instagram. Skipping.")
-        return None
 
+# ----------------------------
+# OPEN A LOGGED-IN SMTP SESSION (IMPLICIT TLS ON 465, NO STARTTLS UPGRADE) THAT CAN SEND SEVERAL EMAILS.
+# USE IT AS `with open_smtp_session() as server:` SO IT IS CLOSED EVEN IF A SEND FAILS.
+# ----------------------------
+def open_smtp_session():
+    server = smtplib.SMTP_SSL("smtp.gmail.com", 465)
     try:
-        # Prepare the Actor input based on URL type
-        if url_type == "tiktok":  # TikTok  
-            run_input = {
-                "excludePinnedPosts": True,
-                "postURLs": [url],
-                "resultsPerPage": 1,
-                "shouldDownloadCovers": False,
-                "shouldDownloadSlideshowImages": False,
-                "shouldDownloadSubtitles": False,
-                "shouldDownloadVideos": False,
-                "searchSection": "",
-                "maxProfilesPerQuery": 10
-            }
-        elif url_type == "instagram":  # Instagram
-            run_input = {
-                "addParentData": False,
-                "directUrls": [url],
-                "enhanceUserSearchWithFacebookPage": False,
-                "isUserReelFeedURL": False,
-                "isUserTaggedFeedURL": False,
-                "resultsLimit": 1,
-                "resultsType": "details",
-                "searchLimit": 1,
-                "searchType": "hashtag"
-            }
-
-        # Choose the correct actor based on URL type
-        if url_type == "tiktok":
-            actor_link = "clockworks/free-tiktok-scraper"
-        elif url_type == "instagram":
-            actor_link = "apify/instagram-scraper"
-
-        # Set keys based on URL type
-        if url_type == "tiktok":
-            view_key = "playCount"
-            timestamp_key = "createTimeISO"
-            comment_key = "commentCount"
-            caption_key = "text"
-        elif url_type == "instagram":
-            view_key = "videoPlayCount"
-            timestamp_key = "timestamp"
-            comment_key = "commentsCount"
-            caption_key = "caption"
-
-        # Run the Actor for the single URL and wait for it to finish
-        run = APIFY_CLIENT.actor(actor_link).call(run_input=run_input)
-
-        # Retrieve and update the view count for the current URL
-        item = next(APIFY_CLIENT.dataset(run["defaultDatasetId"]).iterate_items(), None)
-
-        if item:
-            view_count = item.get(view_key, 0)
-            comment_count = item.get(comment_key, None)
-            
-            # Retrieve the likes count based on platform
-            if url_type == "tiktok":
-                likes_count = item.get("diggCount", 0)
-            elif url_type == "instagram":
-                likes_count = item.get("likesCount", 0)
-
-            # Extract the username and share count based on platform
-            # For insagram, we keep share_count as 0
-            share_count = 0
-            if url_type == "tiktok":
-                author_meta = item.get("authorMeta", {})
-                username = author_meta.get("name", None)
-
-                # only tiktok allows us to get the share count, we obtain it here
-                share_count = item.get("shareCount", 0)
-            elif url_type == "instagram":
-                username = item.get("ownerUsername", None)
-
-
-            return username, view_count, comment_count, likes_count, share_count
-        
-        else:
-            return None
-
-    except Exception as e:
-        print(f"Error processing url {url}: {str(e)}")
-        return None
+        server.login(FROM_EMAIL, EMAIL_PASSWORD)
+    except Exception:
+        server.close()
+        raise
+    return server
 
 
 # ----------------------------
 # SEND A NOTIFICATION EMAIL
+# - SENDS OVER `server` WHEN GIVEN (SEE `open_smtp_session`), OTHERWISE OPENS AND CLOSES ITS OWN SESSION.
 # ----------------------------
-def send_notification_email(app, event_id, event_type):
+def send_notification_email(app, event_id, event_type, server=None):
+    if not TO_EMAILS:
+        logger.warning("TO_EMAIL is not set, not sending the notification email for event %s.", event_id)
+        return
+
     vids = get_top_three(event_id)
 
     # decide wording based on event_type
@@ -777,57 +1146,35 @@ def send_notification_email(app, event_id, event_type):
     else:
         timeframe = 'today'
 
-    # Load environment variables
-    FROM_EMAIL = os.getenv("FROM_EMAIL")
-    PASSWORD   = os.getenv("APP_EMAIL_PW")
-    TO_EMAILS  = [email.strip() for email in os.getenv("TO_EMAIL").split(',') if email.strip()]
-
     # Define email subject
-    timestamp = datetime.now(ZoneInfo("America/New_York")).strftime("%b %d, %Y %I:%M %p")
+    timestamp = datetime.now(NY_TZ).strftime("%b %d, %Y %I:%M %p")
     subject = f"Trial Trigger Event for {app} - {timestamp}"
 
-    # Build the HTML message as a plain string (no extra imports)
-    html_message = (
+    # Build the HTML message from parts joined once at the end (no extra imports)
+    parts = [
         "<html>"
-          "<head>"
-            "<style>"
-              ".card { width: 14rem; margin: 10px; box-shadow: 0 4px 8px rgba(0,0,0,0.2); display: inline-block; background-color: rgba(124,235,157,0.4); border-radius: 10px; }"
-              ".card-body { padding: 10px; }"
-              ".card-subtitle { font-size: 0.95rem; color: #6c757d; }"
-              ".card-text { font-size: 0.9rem; }"
-              ".card-link { text-decoration: none; color: #007bff; }"
-              ".container { text-align: center; }"
-              ".big-link { font-size: 1.5rem; font-weight: bold; }"
-            "</style>"
-          "</head>"
+          f"<head>{EMAIL_CSS}</head>"
           "<body>"
             f"<p>This app has seen a significant increase in the number of new trials {timeframe}.</p>"
             "<p>Below are the top three videos for this event:</p>"
             "<div class='container'>"
               "<u><h3>Top Trending Videos For This Event</h3></u>"
               "<div>"
-    )
+    ]
 
-    # Loop through each video and create a card
+    # One card per video (the deltas come back with NULL as 0, see `get_top_three`)
     for vid in vids:
-        card_html = (
-            "<div class='card'>"
-              "<div class='card-body'>"
-                f"<h6 class='card-subtitle'>{vid.get('creator_username', 'Unknown Creator')}</h6>"
-                "<p class='card-text'>"
-                  f"<strong>&Delta; Views:</strong> {vid.get('delta_views', 0):,}<br>"
-                  f"<strong>&Delta; Comments:</strong> {vid.get('delta_comments', 0):,}<br>"
-                  f"<strong>&Delta; Likes:</strong> {vid.get('delta_likes', 0):,}<br>"
-                  f"<strong>&Delta; Shares:</strong> {vid.get('delta_shares', 0):,}"
-                "</p>"
-                f"<a href='{vid['post_url']}' class='card-link' target='_blank'>View Post</a>"
-              "</div>"
-            "</div>"
-        )
-        html_message += card_html
+        parts.append(EMAIL_CARD_TMPL.format(
+            creator_username=vid.get('creator_username', 'Unknown Creator'),
+            delta_views=vid['delta_views'],
+            delta_comments=vid['delta_comments'],
+            delta_likes=vid['delta_likes'],
+            delta_shares=vid['delta_shares'],
+            post_url=vid['post_url'],
+        ))
 
     # Finish the HTML message with a larger "Check it out" link and closing signature
-    html_message += (
+    parts.append(
               "</div>"
             "</div>"
             f"<p class='big-link'>Check it out: <a href='https://website-5g58.onrender.com/video_metrics/{event_id}'>Video Metrics</a></p>"
@@ -835,82 +1182,117 @@ def send_notification_email(app, event_id, event_type):
           "</body>"
         "</html>"
     )
+    html_message = "".join(parts)
 
-    # Manually build email content with a Content-Type header for HTML
-    email_content = f"Subject: {subject}\nContent-Type: text/html\n\n{html_message}"
+    # HTML email; recipients go in Bcc, so one message reaches all of them without listing the others
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = FROM_EMAIL
+    msg["To"] = FROM_EMAIL
+    msg["Bcc"] = ", ".join(TO_EMAILS)
+    msg.set_content(html_message, subtype="html")
 
     try:
-        print(f"Sending email to {TO_EMAILS}...")
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(FROM_EMAIL, PASSWORD)
-        server.sendmail(FROM_EMAIL, TO_EMAILS, email_content)
-        server.quit()
-        print("Email sent successfully!")
+        logger.info("Sending email to %s...", TO_EMAILS)
+        if server is None:
+            with open_smtp_session() as own_server:
+                own_server.send_message(msg)
+        else:
+            server.send_message(msg)
+        logger.info("Email sent successfully!")
     except smtplib.SMTPAuthenticationError:
-        print("Failed to authenticate. Check your email/password.")
+        logger.error("Failed to authenticate. Check your email/password.")
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("An error occurred: %s", e)
 
 
 # ----------------------------
 # GET THE TOP THREE VIDEOS TO BE USED IN THE NOTIFICATION EMAIL
+# - MEMOIZED PER EVENT: AN EVENT'S VideoMetricDeltas ROWS ARE WRITTEN ONCE, BEFORE ANY EMAIL FOR IT GOES OUT.
+# - ERRORS ARE RAISED FROM THE CACHED FETCH AND HANDLED IN `get_top_three`, SO A FAILED QUERY IS NOT CACHED.
 # ----------------------------
-def get_top_three(event_id):
-
-    try:
-        conn = psycopg2.connect(CONN_STR)
-        cursor = conn.cursor()
-
-        # Videos for the trigger event
-        query = """
-            SELECT *
-            FROM VideoMetricDeltas
-            WHERE trial_trigger_event_id = %s
-            ORDER BY id ASC;
-        """
+@lru_cache(maxsize=256)
+def _fetch_top_three(event_id):
+    # Videos for the trigger event, ranked in SQL by raw_score (the weighted sum of the deltas); only the
+    # top three rows, and only the columns the email shows, come back. A NULL delta is returned as 0.
+    # NOTE: THIS SHOULD BE IDENTICAL TO THE SCORING CALCULATION IN get_engagement in server.py. Otherwise will be inconsistent
+    query = """
+        SELECT
+            v.creator_username,
+            v.post_url,
+            COALESCE(v.delta_views, 0) AS delta_views,
+            COALESCE(v.delta_comments, 0) AS delta_comments,
+            COALESCE(v.delta_likes, 0) AS delta_likes,
+            COALESCE(v.delta_shares, 0) AS delta_shares
+        FROM VideoMetricDeltas v
+        CROSS JOIN LATERAL (
+            SELECT COALESCE(v.delta_views, 0)
+                 + COALESCE(v.delta_comments, 0)
+                 + COALESCE(v.delta_likes, 0) * 5
+                 + COALESCE(v.delta_shares, 0) * 10 AS raw_score
+        ) s
+        WHERE v.trial_trigger_event_id = %s
+        ORDER BY s.raw_score DESC, v.id ASC
+        LIMIT 3;
+    """
+    with db_cursor(readonly=True) as (conn, cursor):
         cursor.execute(query, (event_id,))
         rows = cursor.fetchall()
         headers = [desc[0] for desc in cursor.description]
 
-        # Convert rows to a list of dictionaries.
-        video_metrics = [dict(zip(headers, row)) for row in rows]
-
-        # Convert the event row to a dictionary (so you can display its fields easily in the template)
-        event_details = dict(zip(headers, rows)) if rows else {}
-
-        # Define a function to calculate the score.
-        # NOTE: THIS SHOULD BE IDENTICAL TO THE SCORING CALCULATION IN get_engagement in server.py. Otherwise will be inconsistent
-        def calculate_score(metric):
-            delta_views = metric.get('delta_views') or 0
-            delta_comments = metric.get('delta_comments') or 0
-            delta_likes = metric.get('delta_likes') or 0
-            delta_shares = metric.get('delta_shares') or 0
-            return delta_views + delta_comments + (delta_likes * 5) + (delta_shares * 10)
-
-        # First, calculate and store the raw score for each metric.
-        for metric in video_metrics:
-            metric['raw_score'] = calculate_score(metric)
-
-        # Calculate the total raw score.
-        total_raw_score = sum(metric['raw_score'] for metric in video_metrics)
-
-        # Now, compute the normalized score for each metric.
-        for metric in video_metrics:
-            metric['score'] = round((metric['raw_score'] / total_raw_score) * 100, 3)
-
-        # Sort the metrics by score in descending order.
-        video_metrics_sorted = sorted(video_metrics, key=lambda m: m['score'], reverse=True)
-
-        first_three = video_metrics_sorted[:3]
-
-        return first_three
+    # Convert rows to dictionaries; a tuple so the shared cached value cannot be reordered or extended.
+    return tuple(dict(zip(headers, row)) for row in rows)
 
 
+def get_top_three(event_id):
+    try:
+        return _fetch_top_three(event_id)
     except Exception as e:
-        print("Error obtaining data for the trigger event top three\n")
-        return []
+        logger.error("Error obtaining data for the trigger event top three: %s", e)
+        return ()
+
 
+# ----------------------------
+# RUN THE HOURLY CHECK FOR EVERY APP IN `app_names`, THEN SCRAPE AND EMAIL FOR THE ONES THAT TRIGGERED.
+# - THE PER-APP CHECKS RUN ONE AFTER ANOTHER: THE TRIAL COUNTS FOR ALL APPS COME FROM ONE QUERY, SO EACH
+#   CHECK IS ONLY THE THRESHOLD MATH PLUS AN INSERT WHEN IT FIRES. THE SLOW PART, THE APIFY SCRAPE,
+#   IS ALREADY SHARED BY ALL TRIGGERED APPS AND RUN CONCURRENTLY IN `fire_downstream`.
+# - RETURNS THE TRIGGERED APPS MAPPED TO THEIR EVENT IDS.
+# ----------------------------
+def run_all(app_names):
+
+    # Skip apps another run of this script is already handling today
+    with app_run_locks(app_names) as locked_apps:
+        for app in app_names:
+            if app not in locked_apps:
+                logger.info("%s : Another run is already checking this app, skipping", app)
+
+        recently_triggered = get_recently_triggered_apps(locked_apps)
+
+        # One NewTrials query for every app that still needs checking
+        hourly_by_app = fetch_hourly_stats([app for app in locked_apps if app not in recently_triggered])
+
+        # First decide which apps trigger, then run the downstream actions for all of them together
+        triggered = {}
+        for app in locked_apps:
+            logger.info("=================================")
+            if app in recently_triggered:
+                logger.info("%s : Hourly trigger already fired in the last 3 hours, skipping", app)
+                logger.info("=================================")
+                continue
+            logger.info("Looking at metrics for: %s", app)
+            event_id = log_hourly_event(app, hourly_by_app[app])
+            if event_id is not None:
+                triggered[app] = event_id
+                logger.info("%s : Threshold exceeded, running scraper", app)
+            else:
+                logger.info("%s : Threshold NOT exceeded, NOT running scraper", app)
+            logger.info("=================================")
+
+        # One view scrape for every app that triggered, then the notification emails
+        fire_downstream(triggered, "hourly")
+
+    return triggered
 
 
 # ----------------------------
@@ -919,16 +1301,13 @@ def get_top_three(event_id):
 if __name__ == "__main__":
 
     # Define your app names properly
-    APP_NAMES = ["saga", "berry", "haven", "astra"]
+    APP_NAMES = list(APP_DB_NAME)
 
-    for app in APP_NAMES:
-        print("=================================")
-        print("Looking at metrics for: ", app)
-        if trial_trigger(app):
-            print(app, ": Threshold exceeded, running scraper")
-        else:
-            print(app, ": Threshold NOT exceeded, NOT running scraper")
-        print("=================================")
+    log_listener = start_logging()
+    try:
+        run_all(APP_NAMES)
+    finally:
+        log_listener.stop()
 
     # # EMAIL TESTING
     # send_notification_email("Testing", 926)
@@ -936,4 +1315,4 @@ if __name__ == "__main__":
     # # DEBUG / RETROACTIVE ROW ADDITION, this will probably not be used again
     # # If need to add something retroactively, can do so like this:
     # row = 0, "https://www.tiktok.com/@piperrockelle/video/7491073331660180778", "piperrockelle", "Dylano", "Haven", 0, 0, None, None, None, 0, 0
-    # process_video_row(row, 1916)
\ No newline at end of file
+    # process_video_row(row, 1916, hit_apify(row[1]))
\ No newline at end of file